@@ -37,6 +37,9 @@ from models import audiomodel
 from models import calmodel
 from models import csvmodel
 from models import stimulusmodel
+from models import stimulusindex
+from models import playbackengine
+from models import stimuluscache
 # View imports
 from views import mainview
 from views import sessionview
@@ -92,6 +95,21 @@ class Application(tk.Tk):
         # Start with an invalid response
         self.response = 999
 
+        # Output stream is opened on first playback
+        self.engine = None
+
+        # Audio file details database (opened at task start)
+        self.stimindex = None
+
+        # Audio files played outside of trials (e.g., calibration)
+        self._audio_cache = None
+
+        # Periodic sessionpars save during the task
+        self._autosave_id = None
+
+        # Periodic check for csv writer and audio stream errors
+        self._error_poll_id = None
+
         # Load current session parameters from file
         # or load defaults if file does not exist yet
         # Check for version updates and destroy if mandatory
@@ -142,7 +160,7 @@ class Application(tk.Tk):
             '<<CalibrationSubmit>>': lambda _: self._calc_offset(),
 
             # Audio dialog commands
-            '<<AudioDialogSubmit>>': lambda _: self._save_sessionpars(),
+            '<<AudioDialogSubmit>>': lambda _: self._on_audio_dialog_submit(),
 
             # Main View commands
             '<<MainViewA>>': lambda _: self._on_A(),
@@ -220,14 +238,48 @@ class Application(tk.Tk):
         """ Update the trial count label.
         """
         self.trial_var.set(f"Trial {self.trial_counter+1} of " + 
-            f"{self.matrix.shape[0]}")
+            f"{self.stimmodel.num_trials}")
         self.update_idletasks()
 
 
     def _quit(self):
-        """ Exit the application.
+        """ Write queued trial data, save sessionpars and exit the
+            application. The application closes even if saving 
+            fails.
         """
-        self.destroy()
+        self._stop_autosave()
+        if self._error_poll_id is not None:
+            self.after_cancel(self._error_poll_id)
+            self._error_poll_id = None
+
+        # Write queued trial data and close data file first, so
+        # a failure saving settings cannot lose records
+        try:
+            self.csvmodel.close()
+            self._check_writer_errors()
+        finally:
+            try:
+                # Write runtime values kept in memory during the task
+                self._save_sessionpars()
+            finally:
+                self._release_resources()
+                self.destroy()
+
+
+    def _release_resources(self):
+        """ Stop background stimulus loading and close the 
+            stimulus index and output stream.
+        """
+        try:
+            self.stimmodel.cache.shutdown()
+        except AttributeError:
+            pass
+        if self.stimindex is not None:
+            self.stimindex.close()
+            self.stimindex = None
+
+        # Close output stream
+        self._close_engine()
 
 
     ###################
@@ -235,26 +287,37 @@ class Application(tk.Tk):
     ###################
     def start_task(self):
         """ Create trial counter.
+            Create and check stimulus model.
             Disable "Start Task" from file menu.
             Bind keys to response functions.
-            Create stimulus model.
             Present first trial.
         """
         # Create trial counter
         self.trial_counter = 0
 
-        # Disable "Start Task" from File menu
-        self.menu.file_menu.entryconfig('Start Task', state='disabled')
+        # Audio objects for the current trial
+        self._trial_audio = dict()
 
-        # Bind keys to main_frame response functions
-        self.bind('1', lambda event: self.main_frame.on_A())
-        self.bind('2', lambda event: self.main_frame.on_B())
-        self.bind('7', lambda event: self.main_frame.toggle_nodiff_chkbtn())
-        self.bind('<Return>', lambda event: self.main_frame._on_submit())
+        # Audio file details are kept between sessions, next to 
+        # the config file
+        if self.stimindex is None:
+            self.stimindex = stimulusindex.StimulusIndex(
+                self.sessionpars_model.filepath.parent / 'stimulus_index.db')
+
+        # An empty seed entry means a new random order (seed 0)
+        try:
+            seed = self.sessionpars['random_seed'].get()
+        except tk.TclError:
+            seed = 0
+            self.sessionpars['random_seed'].set(seed)
 
         # Create stimulus model
         try:
-            self.stimmodel = stimulusmodel.StimulusModel(self.sessionpars)
+            self.stimmodel = stimulusmodel.StimulusModel(
+                self.sessionpars,
+                seed=seed or None,
+                index=self.stimindex
+            )
         except FileNotFoundError:
             messagebox.showerror(
                 title="File Not Found",
@@ -262,10 +325,84 @@ class Application(tk.Tk):
                 detail="Go to File>Session to specify a valid matrix file path."
             )
             return
+        except audio_exceptions.InvalidMatrixFile as e:
+            messagebox.showerror(
+                title="Invalid Matrix File",
+                message="Cannot read the matrix file!",
+                detail=f"{e.problem}\n\nGo to File>Session to specify " +
+                    "a valid matrix file path."
+            )
+            return
+        except audio_exceptions.InvalidTrialOrder as e:
+            messagebox.showerror(
+                title="Invalid Trial Order",
+                message="Cannot randomize trials!",
+                detail=f"{e.problem}. Go to File>Session to change " +
+                    "the randomization options."
+            )
+            return
+
+        # Check all audio files at once
+        try:
+            self.stimmodel.check_audio_files()
+        except audio_exceptions.MissingAudioFiles as e:
+            names = [os.path.basename(path) for path in e.files] + [
+                f"{os.path.basename(path)} (unreadable)" 
+                for path in e.unreadable
+            ]
+            if len(names) > 20:
+                names = names[:20] + [f"...and {len(names) - 20} more"]
+            messagebox.showerror(
+                title="Files Not Found",
+                message=f"Cannot find {len(e.files)} and cannot read " +
+                    f"{len(e.unreadable)} audio file(s) named in the " +
+                    "matrix file!",
+                detail="\n".join(names)
+            )
+            return
 
-        # Get matrix of trials
-        self.matrix = self.stimmodel.matrix
-        print('\n', self.matrix)
+        # Check every trial for clipping before the participant 
+        # starts (uses cached peaks; no audio is scanned)
+        try:
+            self.stimmodel.check_clipping(
+                self.sessionpars['slm_offset'].get())
+        except audio_exceptions.ClippingTrials as e:
+            lines = [
+                f"Row {row}: {os.path.basename(path)} (+{over} dB)"
+                for row, path, over in e.trials
+            ]
+            if len(lines) > 20:
+                lines = lines[:20] + [f"...and {len(lines) - 20} more"]
+            messagebox.showerror(
+                title="Clipping",
+                message=f"{len(e.trials)} stimulus presentation(s) in " +
+                    "the matrix file would clip!",
+                detail="\n".join(lines) + "\n\nLower the presentation " +
+                    "levels in the matrix file, or recalibrate."
+            )
+            return
+
+        # Disable "Start Task" from File menu
+        # (only once the checks above have passed)
+        self.menu.file_menu.entryconfig('Start Task', state='disabled')
+
+        # Bind keys to main_frame response functions
+        self.bind('1', lambda event: self.main_frame.on_A())
+        self.bind('2', lambda event: self.main_frame.on_B())
+        self.bind('7', lambda event: self.main_frame.toggle_nodiff_chkbtn())
+        self.bind('<Return>', lambda event: self.main_frame._on_submit())
+
+        # Get first trial
+        self.trial = self.stimmodel.trials[self.trial_counter]
+        print(f"\ncontroller: {self.stimmodel.num_trials} trials")
+
+        # Save settings at session start, then only periodically
+        self._save_sessionpars()
+        self._schedule_autosave()
+
+        # Report errors from background trial data writes and
+        # audio streams
+        self._poll_errors()
 
         # Update trial label
         self._update_trial_label()
@@ -284,6 +421,9 @@ class Application(tk.Tk):
         self.main_frame._select_btn('A')
         self._on_A()
 
+        # Load next trial's audio while this trial is judged
+        self._prefetch_next_trial()
+
 
     ########################
     # Main View Functions #
@@ -297,13 +437,10 @@ class Application(tk.Tk):
         # Present trial        
         # Convert db level to scaling factor
         # Updates sessionpars
-        self._calc_level(self.matrix.iloc[self.trial_counter, 2])
+        self._calc_level(self.trial.pres_level)
 
-        print(f"controller: A: playing {os.path.basename(self.matrix.iloc[self.trial_counter, 0])}")
-        self.present_audio(
-            audio=Path(self.matrix.iloc[self.trial_counter, 0]),
-            pres_level=self.sessionpars['adjusted_level_dB'].get()
-        )
+        print(f"controller: A: playing {os.path.basename(self.trial.audio_A)}")
+        self._present_stimulus(0)
 
 
     def _on_B(self):
@@ -315,13 +452,146 @@ class Application(tk.Tk):
         # Present trial        
         # Convert db level to scaling factor
         # Updates sessionpars
-        self._calc_level(self.matrix.iloc[self.trial_counter, 2])
+        self._calc_level(self.trial.pres_level)
+
+        print(f"controller: B: playing {os.path.basename(self.trial.audio_B)}")
+        self._present_stimulus(1)
+
+
+    def _present_stimulus(self, column):
+        """ Present stimulus A (COLUMN 0) or B (COLUMN 1) of the 
+            current trial at the adjusted level. In 'hard' or 
+            'crossfade' switch modes, both stimuli are loaded into 
+            the output stream and the press switches between them.
+        """
+        paths = (self.trial.audio_A, self.trial.audio_B)
+        pair = []
+        for audio_path in paths:
+            audio = self._get_trial_audio(audio_path)
+            if audio is None:
+                return
+            pair.append(audio)
+        self.a = pair[column]
+
+        # Add each file's level matching gain (0 dB in 'raw' mode)
+        pres_level = self.sessionpars['adjusted_level_dB'].get()
+        pair_levels = [
+            pres_level + self.stimmodel.level_compensation(audio_path)
+            for audio_path in paths
+        ]
+        if self.sessionpars['switch_mode'].get() == 'restart':
+            self._play(pair_levels[column])
+        else:
+            self._play(pair_levels, pair=pair, index=column)
+
+
+    def _get_trial_audio(self, audio_path):
+        """ Return the audio object for AUDIO_PATH. Audio objects 
+            are kept for the current trial, so repeat presses 
+            reuse their prepared playback buffers.
+        """
+        try:
+            return self._trial_audio[audio_path]
+        except KeyError:
+            pass
+
+        # Long stimuli are streamed from the file and resampled 
+        # by the engine. Others come from the stimulus cache, at 
+        # the output stream rate so the stream is not reopened.
+        samplerate = self.sessionpars['audio_samplerate'].get()
+        try:
+            if self._is_streamed(audio_path, self._get_stream_min_s()):
+                audio = audiomodel.Audio(audio=Path(audio_path))
+            else:
+                signal, fs = self.stimmodel.cache.get(audio_path,
+                    samplerate=samplerate)
+                audio = audiomodel.Audio(audio=signal, sampling_rate=fs, 
+                    peaks=self.stimmodel.cache.get_peaks(audio_path,
+                        samplerate=samplerate))
+        except FileNotFoundError:
+            messagebox.showerror(
+                title="File Not Found",
+                message="Cannot find the audio file!",
+                detail="Go to File>Session to specify a valid audio path."
+            )
+            self._show_session_dialog()
+            return None
+
+        # Keep an object the background thread added meanwhile
+        return self._trial_audio.setdefault(audio_path, audio)
 
-        print(f"controller: B: playing {os.path.basename(self.matrix.iloc[self.trial_counter, 1])}")
-        self.present_audio(
-            audio=Path(self.matrix.iloc[self.trial_counter, 1]),
-            pres_level=self.sessionpars['adjusted_level_dB'].get()
-        )
+
+    def _prefetch_next_trial(self):
+        """ Decode the audio files for the next trial and prepare 
+            their playback buffers on a background thread.
+        """
+        self._next_trial_audio = dict()
+
+        next_trial = self.trial_counter + 1
+        if next_trial >= self.stimmodel.num_trials:
+            return
+
+        # Read playback settings here: tk variables must not be 
+        # accessed from the background thread
+        samplerate = self.sessionpars['audio_samplerate'].get()
+        stream_min_s = self._get_stream_min_s()
+        trial = self.stimmodel.trials[next_trial]
+        paths = [trial.audio_A, trial.audio_B]
+        self.stimmodel.cache.prefetch(
+            [path for path in paths 
+             if not self._is_streamed(path, stream_min_s)],
+            samplerate=samplerate)
+
+        pres_level = float(trial.pres_level
+            - self.sessionpars['slm_offset'].get())
+        pair_levels = [
+            pres_level + self.stimmodel.level_compensation(audio_path)
+            for audio_path in paths
+        ]
+        settings = {
+            'device_id': self.sessionpars['audio_device'].get(),
+            'routing': self._format_routing(
+                self.sessionpars['channel_routing'].get())
+        }
+        self.stimmodel.cache.submit(self._prepare_trial_audio, paths,
+            pair_levels, settings, samplerate, stream_min_s, 
+            self._next_trial_audio)
+
+
+    def _prepare_trial_audio(self, paths, pair_levels, settings, 
+            samplerate, stream_min_s, audio_objects):
+        """ Create audio objects and prepare their playback buffers
+            (runs on the background thread). Stimuli that will be 
+            streamed are left to the Tk thread: they are not read 
+            ahead. Errors are skipped here and reported when the 
+            stimulus is played. AUDIO_OBJECTS may already be the 
+            current trial's: an object the Tk thread created in 
+            the meantime is kept, so repeat presses reuse the same
+            playback buffers.
+        """
+        for audio_path, level in zip(paths, pair_levels):
+            if self._is_streamed(audio_path, stream_min_s):
+                continue
+            try:
+                signal, fs = self.stimmodel.cache.get(audio_path,
+                    samplerate=samplerate)
+                a = audiomodel.Audio(audio=signal, sampling_rate=fs, 
+                    peaks=self.stimmodel.cache.get_peaks(audio_path,
+                        samplerate=samplerate))
+                a.prepare(level=level, **settings)
+            except Exception as e:
+                print(f"controller: Could not prepare {audio_path}: {e}")
+                continue
+            audio_objects.setdefault(audio_path, a)
+
+
+    def _is_streamed(self, audio_path, stream_min_s):
+        """ True if the stimulus at AUDIO_PATH is at least 
+            STREAM_MIN_S long (see _get_stream_min_s). Safe to 
+            call from the background thread.
+        """
+        duration = self.stimmodel.duration(audio_path)
+        return (duration is not None) and (duration >= stream_min_s)
 
 
     def _on_no_diff(self):
@@ -334,7 +604,7 @@ class Application(tk.Tk):
             stimulus list.
         """
         # Get instructions
-        instructions = self.matrix.iloc[self.trial_counter, 3]
+        instructions = self.trial.instructions
         self.main_frame.text_var.set("")
         self.main_frame.text_var.set(instructions)
 
@@ -342,7 +612,7 @@ class Application(tk.Tk):
     def _set_image(self):
         """ Get the next image file from the master stimulus list.
         """
-        img_path = Path(self.matrix.iloc[self.trial_counter, 4])
+        img_path = Path(self.trial.image)
                         
         img = Image.open(img_path)
         #img = img.resize((259, 192))
@@ -367,8 +637,14 @@ class Application(tk.Tk):
         # Increase trial counter
         self.trial_counter += 1
 
+        # Use audio objects prepared during the previous trial
+        self._trial_audio = self._next_trial_audio
+
         # Present trial
-        if self.trial_counter < self.matrix.shape[0]:
+        if self.trial_counter < self.stimmodel.num_trials:
+            # Get next trial
+            self.trial = self.stimmodel.trials[self.trial_counter]
+
             # Update trial label
             self._update_trial_label()
 
@@ -383,6 +659,9 @@ class Application(tk.Tk):
             # Start with "A"
             self.main_frame._select_btn('A')
             self._on_A()
+
+            # Load next trial's audio while this trial is judged
+            self._prefetch_next_trial()
         else:
             print("\ncontroller: Task complete! Goodbye!")
             messagebox.showinfo(
@@ -390,7 +669,7 @@ class Application(tk.Tk):
                 message="Please let the investigator know you have " +
                     "finished the task!"
             )
-            self.destroy()
+            self._quit()
             return
 
 
@@ -403,9 +682,14 @@ class Application(tk.Tk):
             converted[key] = self.sessionpars[key].get()
 
         converted['trial'] = self.trial_counter + 1
-        converted['category'] = self.matrix.iloc[self.trial_counter, 5]
-        converted['audio_A'] = os.path.basename(self.matrix.iloc[self.trial_counter, 0])
-        converted['audio_B'] = os.path.basename(self.matrix.iloc[self.trial_counter, 1])
+        converted['random_seed'] = self.stimmodel.seed
+        converted['category'] = self.trial.category
+        converted['audio_A'] = os.path.basename(self.trial.audio_A)
+        converted['audio_B'] = os.path.basename(self.trial.audio_B)
+        converted['level_comp_A_dB'] = \
+            self.stimmodel.level_compensation(self.trial.audio_A)
+        converted['level_comp_B_dB'] = \
+            self.stimmodel.level_compensation(self.trial.audio_B)
         
         if self.response == 'A':
             converted['selected'] = converted['audio_A']
@@ -418,7 +702,9 @@ class Application(tk.Tk):
         save_list = ['trial', 'subject', 'condition', 'audio_A', 'audio_B',
             'selected', 'category', 'slm_reading', 'cal_level_dB', 
             'slm_offset', 'adjusted_level_dB', 'desired_level_dB',
-            'randomize', 'repetitions']
+            'randomize', 'random_seed', 'no_repeats', 'swap_ab',
+            'block_by_category', 'repetitions', 'level_mode', 
+            'match_ref_dB', 'level_comp_A_dB', 'level_comp_B_dB']
 
         # Create new dict with desired items
         try:
@@ -431,30 +717,62 @@ class Application(tk.Tk):
                 message="Data not saved!",
                 detail=f'{e} is undefined.'
             )
-            self.destroy()
+            self._quit()
             return
 
-        # Write data to file
+        # Queue data to be written on the csv writer thread
         print('controller: Calling save record function...')
-        try:
-            self.csvmodel.save_record(data)
-        except PermissionError as e:
-            print(e)
-            messagebox.showerror(
-                title="Access Denied",
-                message="Data not saved! Cannot write to file!",
-                detail=e
-            )
-            #self.destroy()
-            return
-        except OSError as e:
-            print(e)
-            messagebox.showerror(
-                title="File Not Found",
-                message="Cannot find file or directory!",
-                detail=e
-            )
+        self.csvmodel.save_record_async(data)
+
+
+    def _check_writer_errors(self):
+        """ Report errors from the csv writer thread.
+        """
+        for e in self.csvmodel.get_errors():
+            if isinstance(e, PermissionError):
+                messagebox.showerror(
+                    title="Access Denied",
+                    message="Data not saved! Cannot write to file!",
+                    detail=e
+                )
+            elif isinstance(e, OSError):
+                messagebox.showerror(
+                    title="File Not Found",
+                    message="Cannot find file or directory!",
+                    detail=e
+                )
+            else:
+                messagebox.showerror(
+                    title="Data Not Saved",
+                    message="Data not saved! Cannot write the trial record!",
+                    detail=e
+                )
+
+
+    def _check_stream_errors(self):
+        """ Report errors from audio stream feeder threads.
+        """
+        if self.engine is None:
             return
+        for e in self.engine.get_errors():
+            if isinstance(e, audio_exceptions.Clipping):
+                print("controller: Clipping has occurred! Aborting!")
+                self._show_clipping_error()
+            else:
+                messagebox.showerror(
+                    title="Playback Stopped",
+                    message="Cannot read the audio file!",
+                    detail=e
+                )
+
+
+    def _poll_errors(self):
+        """ Check for csv writer and audio stream errors while the 
+            task runs.
+        """
+        self._check_writer_errors()
+        self._check_stream_errors()
+        self._error_poll_id = self.after(250, self._poll_errors)
 
 
     ############################
@@ -489,10 +807,32 @@ class Application(tk.Tk):
     def _save_sessionpars(self, *_):
         """ Save current runtime parameters to file 
         """
-        print("\ncontroller: Calling sessionpars model set and save funcs")
-        for key, variable in self.sessionpars.items():
-            self.sessionpars_model.set(key, variable.get())
-            self.sessionpars_model.save()
+        print("\ncontroller: Calling sessionpars model update and save funcs")
+        self.sessionpars_model.update(
+            {key: variable.get() for key, variable in self.sessionpars.items()}
+        )
+        # Only writes to file if a value changed
+        self.sessionpars_model.save()
+
+
+    def _schedule_autosave(self):
+        """ Save sessionpars every 'autosave_interval_s' seconds 
+            while the task runs. The save is skipped if nothing 
+            has changed.
+        """
+        interval_ms = max(1, self.sessionpars['autosave_interval_s'].get()) * 1000
+        self._autosave_id = self.after(interval_ms, self._autosave)
+
+
+    def _autosave(self):
+        self._save_sessionpars()
+        self._schedule_autosave()
+
+
+    def _stop_autosave(self):
+        if self._autosave_id is not None:
+            self.after_cancel(self._autosave_id)
+            self._autosave_id = None
 
 
     ########################
@@ -504,6 +844,18 @@ class Application(tk.Tk):
         print("\ncontroller: Calling audio dialog...")
         audioview.AudioDialog(self, self.sessionpars)
 
+    def _on_audio_dialog_submit(self):
+        """ Save audio settings. The output stream is reopened 
+            with the new device and sampling rate on the next 
+            presentation. Trial audio objects are created again 
+            at the new rate.
+        """
+        self._save_sessionpars()
+        self._close_engine()
+        self._trial_audio = dict()
+        self._next_trial_audio = dict()
+
+
     def _show_calibration_dialog(self):
         """ Display the calibration dialog window
         """
@@ -544,11 +896,12 @@ class Application(tk.Tk):
 
     def _calc_level(self, desired_spl):
         """ Calculate new dB FS level using slm_offset.
+            Called on every presentation, so the new level is only 
+            kept in memory (sessionpars). It is written to file by 
+            the periodic autosave and on quit.
         """
         # Calculate new presentation level
         self.calmodel.calc_level(desired_spl)
-        # Save level - this must be called here!
-        self._save_sessionpars()
 
 
     #######################
@@ -616,6 +969,16 @@ class Application(tk.Tk):
     def _create_audio_object(self, audio, **kwargs):
         # Create audio object
         try:
+            if isinstance(audio, Path):
+                # Read files at the output stream rate, so the 
+                # stream is not reopened
+                samplerate = self.sessionpars['audio_samplerate'].get()
+                cache = self._get_audio_cache()
+                path = audio
+                audio, kwargs['sampling_rate'] = cache.get(path, 
+                    samplerate=samplerate)
+                kwargs['peaks'] = cache.get_peaks(path, 
+                    samplerate=samplerate)
             self.a = audiomodel.Audio(
                 audio=audio,
                 **kwargs
@@ -634,18 +997,38 @@ class Application(tk.Tk):
             raise
 
 
-    def _play(self, pres_level):
+    def _get_audio_cache(self):
+        """ Return the cache for audio files played outside of 
+            trials, creating it on first use.
+        """
+        if self._audio_cache is None:
+            self._audio_cache = stimuluscache.StimulusCache(
+                self.sessionpars['stim_cache_MB'].get() * 1024**2)
+        return self._audio_cache
+
+
+    def _play(self, pres_level, pair=None, index=0):
         """ Format channel routing, present audio and catch 
-            exceptions.
+            exceptions. If PAIR (A and B audio objects) is given,
+            PRES_LEVEL holds the A and B levels, and playback 
+            switches to PAIR[INDEX] without restarting.
         """
+        settings = {
+            'device_id': self.sessionpars['audio_device'].get(),
+            'routing': self._format_routing(
+                self.sessionpars['channel_routing'].get())
+        }
+
         # Attempt to present audio
         try:
-            self.a.play(
-                level=pres_level,
-                device_id=self.sessionpars['audio_device'].get(),
-                routing=self._format_routing(
-                    self.sessionpars['channel_routing'].get())
-            )
+            if (pair is None) and (self.a.dur >= self._get_stream_min_s()):
+                self.a.stream(level=pres_level, **settings, 
+                    engine=self._get_engine())
+            elif pair is None:
+                self.a.play(level=pres_level, **settings, 
+                    engine=self._get_engine())
+            else:
+                self._switch_pair(pair, index, pres_level, settings)
         except audio_exceptions.InvalidAudioDevice as e:
             print(e)
             messagebox.showerror(
@@ -669,22 +1052,95 @@ class Application(tk.Tk):
             self._show_audio_dialog()
         except audio_exceptions.Clipping:
             print("controller: Clipping has occurred! Aborting!")
+            self._show_clipping_error()
+
+
+    def _show_clipping_error(self):
+        """ Report clipping and plot the clipped waveform, if a
+            level-scaled copy exists (streamed stimuli have none).
+        """
+        if self.a.temp is None:
             messagebox.showerror(
                 title="Clipping",
-                message="The level is too high and caused clipping.",
-                detail="The waveform will be plotted when this message is " +
-                    "closed for visual inspection."
+                message="The level is too high and caused clipping."
             )
-            self.a.plot_waveform("Clipped Waveform")
+            return
+
+        messagebox.showerror(
+            title="Clipping",
+            message="The level is too high and caused clipping.",
+            detail="The waveform will be plotted when this message is " +
+                "closed for visual inspection."
+        )
+        self.a.plot_waveform("Clipped Waveform")
+
+
+    def _get_stream_min_s(self):
+        """ Minimum duration (s) of stimuli to stream instead of 
+            preparing a full playback buffer. Only used when A/B 
+            switching restarts playback.
+        """
+        if self.sessionpars['switch_mode'].get() != 'restart':
+            return float('inf')
+        return self.sessionpars['stream_min_s'].get()
+
+
+    def _switch_pair(self, pair, index, pair_levels, settings):
+        """ Load both stimuli of a trial into the output stream and
+            switch to PAIR[INDEX], keeping the playback position.
+        """
+        buffers = []
+        for audio, level in zip(pair, pair_levels):
+            # Keep the audio object for plotting if it clips
+            self.a = audio
+            buffers.append(audio.prepare(level=level, **settings))
+        self.a = pair[index]
+
+        # A and B must share a sampling rate to play in one stream
+        if pair[0].fs != pair[1].fs:
+            print("controller: A/B sampling rates differ; restarting " +
+                  "playback instead of switching")
+            self.a.play(level=pair_levels[index], **settings, 
+                engine=self._get_engine())
+            return
+
+        engine = self._get_engine()
+        engine.load_pair(buffers, self.a.routing, self.a.fs)
+        engine.select(index,
+            crossfade=(self.sessionpars['switch_mode'].get() == 'crossfade'))
 
 
     def stop_audio(self):
+        if self.engine is not None:
+            self.engine.stop()
+            return
+
         try:
             self.a.stop()
         except AttributeError:
             print("\ncontroller: Stop called, but there is no audio object!")
 
 
+    def _get_engine(self):
+        """ Return the session output stream, opening it with the 
+            device and sampling rate from sessionpars on first use.
+        """
+        if self.engine is None:
+            self.engine = playbackengine.PlaybackEngine(
+                device_id=self.sessionpars['audio_device'].get(),
+                samplerate=self.sessionpars['audio_samplerate'].get()
+            )
+        return self.engine
+
+
+    def _close_engine(self):
+        """ Close the session output stream, if open.
+        """
+        if self.engine is not None:
+            self.engine.close()
+            self.engine = None
+
+
     def _format_routing(self, routing):
         """ Convert space-separated string to list of ints
             for speaker routing.
@@ -55,3 +55,65 @@ class MissingSamplingRate(Exception):
 
     def __str__(self):
         return f'Audio Exception: A sampling rate must be provided with numpy array signals.'
+
+
+class MissingAudioFiles(Exception):
+    """ Audio files named in the matrix file do not exist or 
+        cannot be read """
+
+    def __init__(self, files, unreadable=(), *args):
+        super().__init__(args)
+        self.files = files
+        self.unreadable = list(unreadable)
+
+
+    def __str__(self):
+        return f'Audio Exception: {len(self.files)} audio file(s) not found, {len(self.unreadable)} unreadable.'
+
+
+class InvalidMatrixFile(Exception):
+    """ Matrix file does not match the expected columns/types """
+
+    def __init__(self, problem, *args):
+        super().__init__(args)
+        self.problem = problem
+
+
+    def __str__(self):
+        return f'Audio Exception: Invalid matrix file: {self.problem}'
+
+
+class InvalidTrialOrder(Exception):
+    """ Trials cannot be ordered with the chosen randomization """
+
+    def __init__(self, problem, *args):
+        super().__init__(args)
+        self.problem = problem
+
+
+    def __str__(self):
+        return f'Audio Exception: Cannot order trials: {self.problem}'
+
+
+class UnsupportedWavFormat(Exception):
+    """ WAV sample data cannot be memory-mapped """
+
+    def __init__(self, path, *args):
+        super().__init__(args)
+        self.path = path
+
+
+    def __str__(self):
+        return f'Audio Exception: Cannot map samples of {self.path}.'
+
+
+class ClippingTrials(Exception):
+    """ Matrix file trials would clip at their presentation level """
+
+    def __init__(self, trials, *args):
+        super().__init__(args)
+        self.trials = trials
+
+
+    def __str__(self):
+        return f'Audio Exception: {len(self.trials)} stimulus presentation(s) would clip.'
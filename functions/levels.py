@@ -0,0 +1,137 @@
+""" Signal level functions for (samples x channels) arrays.
+    All functions accept scalars or arrays and use NumPy ufuncs;
+    functions that scale a signal can work in place.
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+from scipy import signal as sps
+
+
+#########
+# Funcs #
+#########
+def db2mag(db, out=None):
+    """ Convert decibels to magnitude. DB may be a scalar or
+        an array.
+    """
+    return np.power(10.0, np.divide(db, 20.0), out=out)
+
+
+def mag2db(mag, out=None):
+    """ Convert magnitude to decibels. MAG may be a scalar or
+        an array.
+    """
+    result = np.log10(mag, out=out)
+    return np.multiply(result, 20.0, out=out)
+
+
+def rms(sig, axis=None):
+    """ Root mean square of SIG. AXIS=None gives a single value
+        for all samples; AXIS=0 gives one value per channel.
+        Sums are accumulated in float64.
+    """
+    sig = np.asarray(sig)
+    if axis is None:
+        flat = sig.ravel().astype(np.float64, copy=False)
+        return np.sqrt(np.dot(flat, flat) / flat.size) if flat.size else 0.0
+    return np.sqrt(np.mean(np.square(sig, dtype=np.float64), axis=axis))
+
+
+def peak(sig, axis=None):
+    """ Largest absolute sample value of SIG (per channel with
+        AXIS=0), without making an absolute-value copy. Integer
+        extremes are compared as float64, so the most negative 
+        value does not overflow.
+    """
+    sig = np.asarray(sig)
+    low = sig.min(axis=axis)
+    if sig.dtype.kind == 'i':
+        low = np.asarray(low, dtype=np.float64)
+    return np.maximum(sig.max(axis=axis), -low)
+
+
+def scale(sig, gain, inplace=False):
+    """ Multiply SIG by GAIN (scalar or one value per channel).
+        Float signals keep their dtype; integer signals give a 
+        float result. With INPLACE, SIG (a float array) is 
+        modified.
+    """
+    sig = np.asarray(sig)
+    dtype = np.result_type(sig.dtype, np.float32)
+    gain = np.asarray(gain, dtype=dtype)
+    if inplace:
+        if sig.dtype != dtype:
+            raise TypeError("levels: Cannot scale a " +
+                f"{sig.dtype} signal in place")
+        return np.multiply(sig, gain, out=sig)
+    return np.multiply(sig, gain, dtype=dtype)
+
+
+def set_rms(sig, level_db, equalize=False, inplace=False):
+    """ Scale SIG (samples x channels, or 1-D) so its RMS level
+        is LEVEL_DB (dB re: 1). By default one gain is applied to
+        all channels, keeping level differences between channels:
+        the mean of the channel levels becomes LEVEL_DB. With
+        EQUALIZE, each channel is set to LEVEL_DB. Silent channels
+        are left unchanged.
+    """
+    sig = np.asarray(sig)
+    channel_rms = np.atleast_1d(rms(sig, axis=0))
+    active = channel_rms > 0
+    gain_db = np.zeros_like(channel_rms)
+    if equalize:
+        gain_db[active] = level_db - mag2db(channel_rms[active])
+    elif active.any():
+        gain_db[:] = level_db - np.mean(mag2db(channel_rms[active]))
+    return scale(sig, db2mag(gain_db), inplace=inplace)
+
+
+def k_weighting_sos(fs):
+    """ Second-order sections of the ITU-R BS.1770 K-weighting
+        filter (high shelf, then high pass) at sampling rate FS.
+    """
+    # Stage 1: high shelf
+    gain_db, f0, q = 3.999843853973347, 1681.974450955533, 0.7071752369554196
+    k = np.tan(np.pi * f0 / fs)
+    vh = 10 ** (gain_db / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k**2
+    shelf = [
+        (vh + vb * k / q + k**2) / a0, 2 * (k**2 - vh) / a0,
+        (vh - vb * k / q + k**2) / a0,
+        1, 2 * (k**2 - 1) / a0, (1 - k / q + k**2) / a0
+    ]
+
+    # Stage 2: high pass
+    f0, q = 38.13547087602444, 0.5003270373238773
+    k = np.tan(np.pi * f0 / fs)
+    a0 = 1 + k / q + k**2
+    highpass = [1, -2, 1, 1, 2 * (k**2 - 1) / a0, (1 - k / q + k**2) / a0]
+
+    return np.array([shelf, highpass])
+
+
+def k_weight(sig, fs, zi=None):
+    """ K-weight SIG (samples x channels) along the samples 
+        axis. Pass the returned filter state as ZI to continue 
+        with the next block of the same signal.
+    """
+    sos = k_weighting_sos(fs)
+    if zi is None:
+        zi = np.zeros((len(sos), 2) + np.shape(sig)[1:])
+    return sps.sosfilt(sos, sig, axis=0, zi=zi)
+
+
+def loudness(mean_squares):
+    """ Loudness (LKFS) from the per-channel mean squares of a 
+        K-weighted signal. Ungated, with all channel weights 1.
+        Returns -inf for silence.
+    """
+    total = np.sum(mean_squares)
+    if total <= 0:
+        return -np.inf
+    return -0.691 + 10 * np.log10(total)
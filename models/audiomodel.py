@@ -16,11 +16,14 @@ import os
 from pathlib import Path
 
 # Import audio packages
-import soundfile as sf
 import sounddevice as sd
+import soundfile as sf
 
 # Import custom modules
 from exceptions import audio_exceptions
+from models import devicecache
+from models import wavfile
+from functions import levels
 
 
 #########
@@ -33,10 +36,26 @@ class Audio:
     def __init__(self, audio, **kwargs):
         """ Create audio object using file path or signal array
             audio: a Path object from pathlib, or a numpy array
-            kwargs: must provide a sampling rate when passing an array
+            kwargs: must provide a sampling rate when passing an array;
+                optional 'peaks' gives per-channel peak magnitudes 
+                (re: full scale), so clipping is checked without 
+                scanning the signal
         """
         # Assign public attributes
         self.audio = audio
+        self.peaks = kwargs.get('peaks')
+
+        # Playback buffers keyed by (level, device_id, routing)
+        self._prepared = dict()
+        self.temp = None
+
+        # Per-channel DC offsets and gains for normalizing
+        self._normalization = None
+
+        # Files that cannot be memory-mapped are decoded on 
+        # request (see signal)
+        self._signal = None
+        self._info = None
 
         # Print message to console
         self.msg = "Begin Audio Event"
@@ -81,62 +100,182 @@ class Audio:
             print("audiomodel: Audio file not found!")
             raise FileNotFoundError
         else:
-            self.signal, self.fs = sf.read(self.audio)
+            # Memory-mapped in its native sample format, if possible.
+            # Other files are only decoded if a full buffer is 
+            # needed: streaming reads them one block at a time.
+            try:
+                self.signal, self.fs = wavfile.read_mapped(self.audio)
+            except audio_exceptions.UnsupportedWavFormat:
+                self._info = sf.info(self.audio)
+                self.fs = self._info.samplerate
             print(f"audiomodel: Sampling rate: {self.fs}")
 
 
+    @property
+    def signal(self):
+        """ Signal array. Files that cannot be memory-mapped are
+            decoded (float64) on first access.
+        """
+        if (self._signal is None) and (self._info is not None):
+            print(f"audiomodel: Decoding {os.path.basename(self.audio)}")
+            self._signal, _ = sf.read(self.audio)
+        return self._signal
+
+
+    @signal.setter
+    def signal(self, value):
+        self._signal = value
+
+
     def _get_audio_details(self):
-        # Get number of channels
-        try:
-            self.num_channels = self.signal.shape[1]
-        except IndexError:
-            self.num_channels = 1
+        # Read details from the file header if not yet decoded
+        if self._signal is None:
+            frames = self._info.frames
+            self.num_channels = self._info.channels
+            self.data_type = np.dtype(np.float64)
+        else:
+            frames = len(self._signal)
+            self.num_channels = 1 if self._signal.ndim == 1 else \
+                self._signal.shape[1]
+            self.data_type = self._signal.dtype
         self.channels = np.array(range(1, self.num_channels+1))
         print(f"audiomodel: Number of channels in signal: {self.num_channels}")
 
-        # Assign audio file attributes
-        self.dur = len(self.signal) / self.fs
-        self.t = np.arange(0, self.dur, 1/self.fs)
+        # Assign audio file attributes (time base is built on 
+        # request; see t)
+        self.dur = frames / self.fs
         print(f"audiomodel: Duration: {np.round(self.dur, 2)} seconds " +
             f"({np.round(self.dur/60, 2)} minutes)")
 
-        # Get data type
-        self.data_type = self.signal.dtype
         print(f"audiomodel: Data type: {self.data_type}")
         print("audiomodel: Done")
 
 
+    @property
+    def t(self):
+        """ Time base (s) for the signal. Not stored: only 
+            needed for plotting.
+        """
+        return np.arange(len(self.signal)) / self.fs
+
+
     def stop(self):
         """ Stop audio presentation.
         """
         sd.stop()
 
 
-    def play(self, level=None, device_id=None, routing=None):
+    def play(self, level=None, device_id=None, routing=None, engine=None):
+        """ Prepare playback buffer (see prepare) and present it.
+            ENGINE: an open PlaybackEngine. If not provided, 
+                sounddevice opens a new stream for this buffer.
+        """
+        # Get level-scaled, clip-checked buffer
+        self.prepare(level=level, device_id=device_id, routing=routing)
+
+        # Present audio
+        print("audiomodel: Attempting to present audio")
+        if engine is None:
+            sd.play(self.temp, samplerate=self.fs, mapping=self.routing,
+                device=self.device_id)
+        else:
+            engine.play(self.temp, self.routing, self.fs)
+        print("audiomodel: Done")
+        print('*' * len(self.msg))
+
+
+    def stream(self, level, device_id, routing, engine):
+        """ Present the signal through ENGINE (an open 
+            PlaybackEngine), reading and scaling it one block at 
+            a time. No level-scaled copy of the signal is made; 
+            files that are not memory-mapped are decoded from 
+            disk as they play. LEVEL is required: normalizing 
+            needs the whole signal.
+        """
+        # Initialization
+        self.level = level
+        self.device_id = device_id
+        self.routing = routing
+
+        print("\naudiomodel: Preparing to stream...")
+
+        # Get audio device details
+        try:
+            self._set_defaults()
+        except audio_exceptions.InvalidAudioDevice:
+            print("audiomodel: Invalid audio device!")
+            raise
+
+        # Check channel routing
+        if (not self.routing) or (self.num_channels != len(self.routing)):
+            print("audiomodel: Invalid channel routing!")
+            raise audio_exceptions.InvalidRouting(
+                self.num_channels, self.routing)
+
+        # Drop channels the audio device cannot present (view only;
+        # the engine skips unrouted file channels)
+        if self.num_outputs < self.num_channels:
+            print("audiomodel: Dropping " +
+                f"{self.num_channels - self.num_outputs} audio file channels")
+            self.routing = self.routing[:self.num_outputs]
+
+        mag = levels.db2mag(self.level)
+        print(f"audiomodel: Adjusted Level (dB): {self.level}")
+        print("audiomodel: Attempting to stream audio")
+        try:
+            # Known peaks catch clipping before the stream starts
+            if self._peaks_clip():
+                raise audio_exceptions.Clipping
+            if self._signal is None:
+                # Closed by the engine when the stream ends
+                signal = sf.SoundFile(self.audio)
+            else:
+                signal = self._signal.reshape(len(self._signal), -1)
+                signal = signal[:, 0:len(self.routing)]
+            engine.play_stream(signal, mag, self.routing, self.fs)
+        except audio_exceptions.Clipping:
+            print("audiomodel: Level caused clipping!")
+            raise
+        print("audiomodel: Done")
+        print('*' * len(self.msg))
+
+
+    def prepare(self, level=None, device_id=None, routing=None):
         """ Assign device id. Truncate audio/routing, if necessary,
             based on number of audio device channels. Set level.
+            
+            Returns a float32 buffer ready for playback. Buffers 
+            are stored per level, device and routing, so repeat 
+            presentations reuse them without new allocations.
         """
         # Initialization
         self.level = level
         self.device_id = device_id
         self.routing = routing
 
+        # Reuse existing buffer
+        key = (level, device_id, tuple(routing) if routing else None)
+        if key in self._prepared:
+            print("\naudiomodel: Using prepared playback buffer")
+            self.temp, self.routing = self._prepared[key]
+            return self.temp
+
         print("\naudiomodel: Preparing for playback...")
 
-        # Create a temporary audio file to modify
-        self.temp = self.signal.copy()
-        self.temp = self.temp.astype(np.float32)
+        # Create a float32 copy of the signal (scaled to +/-1) 
+        # to modify
+        self.temp = wavfile.to_float32(self.signal)
         print(f"audiomodel: Data type converted to {self.temp.dtype}")
 
-        # Assign default sounddevice settings
+        # Get audio device details
         try:
             self._set_defaults()
-        except sd.PortAudioError:
+        except audio_exceptions.InvalidAudioDevice:
             print("audiomodel: Invalid audio device!")
-            raise audio_exceptions.InvalidAudioDevice(self.device_id)
+            raise
 
         # Check channel routing
-        if (self.num_channels != len(self.routing)) or (not self.routing):
+        if (not self.routing) or (self.num_channels != len(self.routing)):
             print("audiomodel: Invalid channel routing!")
             raise audio_exceptions.InvalidRouting(
                 self.num_channels, self.routing)
@@ -155,35 +294,28 @@ class Audio:
         # based on available audio device channels
         self._check_channels_and_routing()
 
-        # Present audio
-        print("audiomodel: Attempting to present audio")
-        sd.play(self.temp, mapping=self.routing)
-        print("audiomodel: Done")
-        print('*' * len(self.msg))
+        # Store for repeat presentations
+        self._prepared[key] = (self.temp, self.routing)
+
+        return self.temp
 
 
     #####################
     # Play Helper Funcs #
     #####################
     def _set_defaults(self):
-        """ Set default sounddevice settings based on provided values.
+        """ Look up the audio device in the device cache. Device 
+            and sampling rate are passed to sounddevice directly 
+            at playback.
         """
-        # Assign audio device default
-        try:
-            sd.default.device = self.device_id
-            print(f"audiomodel: Audio device: " + 
-              f"{sd.query_devices(sd.default.device)['name']}")
-        except sd.PortAudioError:
-            raise
-        
+        # Get audio device details
+        device = devicecache.get_device(self.device_id)
+        print(f"audiomodel: Audio device: {device['name']}")
+
         # Get number of available audio device channels
-        self.num_outputs = sd.query_devices(sd.default.device)['max_output_channels']
+        self.num_outputs = device['max_output_channels']
         print(f"audiomodel: Device outputs: {self.num_outputs}")
 
-        # Assign audio device sampling rate based on 
-        # provided audio sampling rate
-        sd.default.samplerate = self.fs
-
 
     def _check_channels_and_routing(self):
         # Check that audio device has enough channels for audio
@@ -195,7 +327,7 @@ class Audio:
             
             # Update audio file and channel routing dimensions to 
             # match number of available audio device outputs
-            self.temp = self.temp[:, 0:self.num_outputs]
+            self.temp = np.ascontiguousarray(self.temp[:, 0:self.num_outputs])
             self.routing = self.routing[:self.temp.shape[1]]
         
         print(f"audiomodel: Audio shape: {self.temp.shape}")
@@ -207,45 +339,67 @@ class Audio:
         if self.level == None:
             # Normalize if no level is provided
             print("audiomodel: No level provided; normalizing to +/-1")
-            if self.num_channels > 1:
-                for chan in range(0, self.num_channels):
-                    # Remove DC offset
-                    self.temp[:, chan] = self.temp[:, chan] - np.mean(self.temp[:, chan])
-                    # Normalize
-                    self.temp[:, chan] = self.temp[:, chan] / np.max(np.abs(self.temp[:, chan]))
-                    # account for num channels
-                    self.temp[:, chan] = self.temp[:, chan] / self.num_channels 
-            elif self.num_channels == 1:
-                # Remove DC offset
-                self.temp = self.temp - np.mean(self.temp)
-                # Normalize
-                self.temp = self.temp / np.max(np.abs(self.temp))
-                # account for num channels
-                self.temp = self.temp / 1
+            offsets, gains = self._get_normalization()
+            # All channels at once, in place (2-D view of self.temp)
+            temp = self.temp.reshape(len(self.temp), -1)
+            temp -= offsets
+            levels.scale(temp, gains, inplace=True)
         else:
             # Convert level in dB to magnitude
-            mag = self.db2mag(self.level)
+            mag = levels.db2mag(self.level)
             print(f"audiomodel: Adjusted Level (dB): {self.level}")
             print(f"audiomodel: Multiplying signal by: {np.round(mag,2)}")
-            # Apply scaling factor to self.temp
-            self.temp = self.temp * mag
+            # Apply scaling factor to self.temp (in place)
+            levels.scale(self.temp, mag, inplace=True)
+
+
+    def _get_normalization(self):
+        """ Return per-channel DC offsets and gains that remove DC,
+            scale each channel's peak to 1 and divide by the number 
+            of channels. Computed once from the float32 signal. 
+            Silent channels get a gain of 0.
+        """
+        if self._normalization is None:
+            temp = self.temp.reshape(len(self.temp), -1)
+            offsets = temp.mean(axis=0, dtype=np.float64).astype(np.float32)
+            # Peak after DC removal, without a shifted copy
+            peaks = np.maximum(temp.max(axis=0) - offsets, 
+                offsets - temp.min(axis=0))
+            gains = np.zeros_like(peaks)
+            np.divide(1, peaks * self.num_channels, out=gains, where=peaks > 0)
+            self._normalization = (offsets, gains)
+        return self._normalization
 
 
     def _check_clipping(self):
         """ Plot clipped waveform for visual inspection.
         """
-        if np.max(np.abs(self.temp)) > 1:
+        # With known peaks and a level, this is a scalar check
+        if (self.peaks is not None) and (self.level is not None):
+            clipping = self._peaks_clip()
+        else:
+            # Compare extremes to avoid a full-size abs() temporary. 
+            # NaN (from an overflowing gain) also counts as clipping.
+            clipping = not levels.peak(self.temp) <= 1
+
+        if clipping:
             # Raise exception to prevent playback
             raise audio_exceptions.Clipping
 
 
+    def _peaks_clip(self):
+        """ True if the known per-channel peaks exceed full scale 
+            at the current level. False if peaks are unknown.
+        """
+        if self.peaks is None:
+            return False
+        return not np.max(self.peaks) * levels.db2mag(self.level) <= 1
+
+
     def plot_waveform(self, title=None):
         """ Plot all channels overlaid.
         """
-        # Create time base
-        dur = len(self.temp) / self.fs
-        t = np.arange(0, dur, 1/self.fs)
-        plt.plot(t, self.temp)
+        plt.plot(self.t, self.temp)
         plt.title(title)
         plt.xlabel("Time (s)")
         plt.ylabel("Amplitude")
@@ -257,127 +411,32 @@ class Audio:
     ###########################
     # Signal Processing Funcs #
     ###########################
+    # Kept for existing callers; see functions/levels.py
     def db2mag(self, db):
-        """ 
-            Convert decibels to magnitude. Takes a single
-            value or a list of values.
+        """ Convert decibels to magnitude (scalar or array).
         """
-        # Must use this form to handle negative db values!
-        try:
-            mag = [10**(x/20) for x in db]
-            return mag
-        except:
-            mag = 10**(db/20)
-            return mag
+        return levels.db2mag(db)
 
 
     def mag2db(self, mag):
-        """ 
-            Convert magnitude to decibels. Takes a single
-            value or a list of values.
+        """ Convert magnitude to decibels (scalar or array).
         """
-        try:
-            db = [20 * np.log10(x) for x in mag]
-            return db
-        except:
-            db = 20 * np.log10(mag)
-            return db
+        return levels.mag2db(mag)
 
 
     def rms(self, sig):
-        """ 
-            Calculate the root mean square of a signal. 
-            
-            NOTE: np.square will return invalid, negative 
-                results if the number excedes the bit 
-                depth. In these cases, convert to int64
-                EXAMPLE: sig = np.array(sig,dtype=int)
-
-            Written by: Travis M. Moore
-            Last edited: Feb. 3, 2020
+        """ Root mean square of all samples in SIG.
         """
-        theRMS = np.sqrt(np.mean(np.square(sig)))
-        return theRMS
+        return levels.rms(sig)
 
 
     def setRMS(self, sig, amp, eq='n'):
+        """ Set RMS level of SIG to AMP (dB). SIG is 1-D, or 
+            channels x samples (as before), with any number of 
+            channels. EQ: 'y' sets each channel to AMP; 'n' keeps 
+            level differences between channels.
         """
-            Set RMS level of a 1-channel or 2-channel signal.
-        
-            SIG: a 1-channel or 2-channel signal
-            AMP: the desired amplitude to be applied to 
-                each channel. Note this will be the RMS 
-                per channel, not the total of both channels.
-            EQ: takes 'y' or 'n'. Whether or not to equalize 
-                the levels in a 2-channel signal. For example, 
-                a signal with an ILD would lose the ILD with 
-                EQ='y', so the default in 'n'.
-
-            EXAMPLE: 
-            Create a 2 channel signal
-            [t, tone1] = mkTone(200,0.1,30,48000)
-            [t, tone2] = mkTone(100,0.1,0,48000)
-            combo = np.array([tone1, tone2])
-            adjusted = setRMS(combo,-15)
-
-            Written by: Travis M. Moore
-            Created: Jan. 10, 2022
-            Last edited: May 17, 2022
-        """
-        if len(sig.shape) == 1:
-            rmsdb = self.mag2db(self.rms(sig))
-            refdb = amp
-            diffdb = np.abs(rmsdb - refdb)
-            if rmsdb > refdb:
-                sigAdj = sig / self.db2mag(diffdb)
-            elif rmsdb < refdb:
-                sigAdj = sig * self.db2mag(diffdb)
-            # Edit 5/17/22
-            # Added handling for when rmsdb == refdb
-            elif rmsdb == refdb:
-                sigAdj = sig
-            return sigAdj
-
-        elif len(sig.shape) == 2:
-            rmsdbLeft = self.mag2db(self.rms(sig[0]))
-            rmsdbRight = self.mag2db(self.rms(sig[1]))
-
-            ILD = np.abs(rmsdbLeft - rmsdbRight) # get lvl diff
-
-            # Determine lvl advantage
-            if rmsdbLeft > rmsdbRight:
-                lvlAdv = 'left'
-                #print("Adv: %s" % lvlAdv)
-            elif rmsdbRight > rmsdbLeft:
-                lvlAdv = 'right'
-                #print("Adv: %s" % lvlAdv)
-            elif rmsdbLeft == rmsdbRight:
-                lvlAdv = None
-
-            #refdb = amp - 3 # apply half amp to each channel
-            refdb = amp
-            diffdbLeft = np.abs(rmsdbLeft - refdb)
-            diffdbRight = np.abs(rmsdbRight - refdb)
-
-            # Adjust left channel
-            if rmsdbLeft > refdb:
-                sigAdjLeft = sig[0] / self.db2mag(diffdbLeft)
-            elif rmsdbLeft < refdb:
-                sigAdjLeft = sig[0] * self.db2mag(diffdbLeft)
-            # Adjust right channel
-            if rmsdbRight > refdb:
-                sigAdjRight = sig[1] / self.db2mag(diffdbRight)
-            elif rmsdbRight < refdb:
-                sigAdjRight = sig[1] * self.db2mag(diffdbRight)
-
-            # If there is a lvl difference to maintain across channels
-            if eq == 'n':
-                if lvlAdv == 'left':
-                    sigAdjLeft = sigAdjLeft * self.db2mag(ILD/2)
-                    sigAdjRight = sigAdjRight / self.db2mag(ILD/2)
-                elif lvlAdv == 'right':
-                    sigAdjLeft = sigAdjLeft / self.db2mag(ILD/2)
-                    sigAdjRight = sigAdjRight * self.db2mag(ILD/2)
-
-            sigBothAdj = np.array([sigAdjLeft, sigAdjRight])
-            return sigBothAdj
+        sig = np.asarray(sig)
+        if sig.ndim == 1:
+            return levels.set_rms(sig, amp)
+        return levels.set_rms(sig.T, amp, equalize=(eq == 'y')).T
@@ -69,4 +69,5 @@ class CalModel:
             f"{self.sessionpars['adjusted_level_dB'].get()}")
 
         # Calculated level not yet saved! 
-        # This must happen in controller using: self._save_sessionpars()
+        # The controller keeps it in memory during the task and 
+        # writes it with the periodic autosave or on quit
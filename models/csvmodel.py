@@ -9,16 +9,38 @@ import csv
 from pathlib import Path
 from datetime import datetime
 import os
+import queue
+import threading
 
 
 #########
 # MODEL #
 #########
 class CSVModel:
-    """ Write provided dictionary to .csv
+    """ Write provided dictionary to .csv. The file is opened on 
+        the first record and kept open until close() is called.
+        Records can also be queued for a background writer thread
+        (see save_record_async).
+        FSYNC_EVERY: force records to disk after this many records
+            (0 disables; records are always flushed to the OS).
+        MAX_PENDING: number of queued records before 
+            save_record_async blocks.
     """
-    def __init__(self, sessionpars):
+    def __init__(self, sessionpars, fsync_every=10, max_pending=100):
         self.sessionpars = sessionpars
+        self.fsync_every = fsync_every
+
+        # Open file handle and writer (see _open)
+        self._fh = None
+        self._writer = None
+        self._unsynced = 0
+
+        # Background writer
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        # Exceptions raised on the writer thread, for the caller 
+        # to report (see get_errors)
+        self._errors = queue.Queue()
 
         # Create data directory name
         self.data_directory = "Data"
@@ -79,23 +101,116 @@ class CSVModel:
             raise PermissionError(msg)
 
 
-    def save_record(self, data):
-        """ Save a dictionary of data to .csv file 
+    def _open(self, fieldnames):
+        """ Check directory and write access, then open the .csv 
+            file for appending. Writes the header for new files.
+            The file name must already be set by _create_file.
         """
         # Verify or create data directory
         self._check_data_directory()
 
-        # Create file name and path
-        self._create_file()
-
         # Check write access
         self._check_write_access()
 
-        # Write data to .csv
+        # Open file and create writer
         newfile = not self.file.exists()
-        with open(self.file, 'a', newline='') as fh:
-            csvwriter = csv.DictWriter(fh, fieldnames=data.keys())
-            if newfile:
-                csvwriter.writeheader()
-            csvwriter.writerow(data)
+        self._fh = open(self.file, 'a', newline='')
+        self._writer = csv.DictWriter(self._fh, fieldnames=fieldnames)
+        if newfile:
+            self._writer.writeheader()
+        print(f"\ncsvmodel: Opened {self.filename} for writing")
+
+
+    def save_record(self, data):
+        """ Save a dictionary of data to .csv file 
+        """
+        # Open file with first record
+        if self._writer is None:
+            self._create_file()
+            self._open(list(data.keys()))
+
+        self._write(data)
+
+
+    def save_record_async(self, data):
+        """ Queue a dictionary of data to be saved on the writer
+            thread. Records are written in the order queued. Blocks
+            if MAX_PENDING records are already waiting. Exceptions
+            are collected for get_errors().
+        """
+        if self._thread is None:
+            # Read file name from tk variables on this thread
+            if self._writer is None:
+                self._create_file()
+            self._thread = threading.Thread(target=self._run,
+                name='csvwriter', daemon=True)
+            self._thread.start()
+
+        self._queue.put(dict(data))
+
+
+    def get_errors(self):
+        """ Return list of exceptions raised on the writer thread 
+            since the last call.
+        """
+        errors = []
+        while True:
+            try:
+                errors.append(self._errors.get_nowait())
+            except queue.Empty:
+                return errors
+
+
+    def _run(self):
+        """ Write queued records until the stop sentinel (None) 
+            is received (runs on the writer thread). Any error 
+            is reported and the queue keeps draining, so callers 
+            never block on a dead thread.
+        """
+        while True:
+            data = self._queue.get()
+            if data is None:
+                return
+            try:
+                if self._writer is None:
+                    self._open(list(data.keys()))
+                self._write(data)
+            except Exception as e:
+                print(e)
+                self._errors.put(e)
+
+
+    def _write(self, data):
+        """ Write record to the open file.
+        """
+        # Write data to .csv
+        self._writer.writerow(data)
+        self._fh.flush()
+
+        # Periodically force data to disk
+        self._unsynced += 1
+        if self.fsync_every and (self._unsynced >= self.fsync_every):
+            os.fsync(self._fh.fileno())
+            self._unsynced = 0
         print("\ncsvmodel: Record successfully saved!")
+
+
+    def close(self):
+        """ Write any queued records, then flush remaining records 
+            to disk and close the file.
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+        if self._fh is None:
+            return
+
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        self._fh.close()
+        self._fh = None
+        self._writer = None
+        self._unsynced = 0
+        print("\ncsvmodel: Closed data file")
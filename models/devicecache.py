@@ -0,0 +1,60 @@
+""" Cached audio device information, shared by the audio
+    settings dialog and the audio models. Devices are
+    enumerated once; call refresh() to enumerate again.
+"""
+
+###########
+# Imports #
+###########
+# Import audio packages
+import sounddevice as sd
+
+# Import custom modules
+from exceptions import audio_exceptions
+
+
+#########
+# BEGIN #
+#########
+# List of device info dicts, indexed by device ID
+_devices = None
+
+
+def refresh():
+    """ Enumerate audio devices and replace the cached list.
+    """
+    global _devices
+    print("\ndevicecache: Querying audio devices...")
+    _devices = [dict(device) for device in sd.query_devices()]
+    return _devices
+
+
+def query_devices():
+    """ Return the cached device list, enumerating devices
+        only on first use.
+    """
+    if _devices is None:
+        return refresh()
+    return _devices
+
+
+def get_device(device_id):
+    """ Return info dict for DEVICE_ID. Raises InvalidAudioDevice
+        if the ID does not exist.
+    """
+    devices = query_devices()
+    if (not isinstance(device_id, int)) or \
+        (not 0 <= device_id < len(devices)):
+        raise audio_exceptions.InvalidAudioDevice(device_id)
+    return devices[device_id]
+
+
+def output_devices():
+    """ Return list of (device ID, name, output channels) tuples
+        for devices with at least one output.
+    """
+    return [
+        (ii, device['name'], device['max_output_channels'])
+        for ii, device in enumerate(query_devices())
+        if device['max_output_channels'] > 0
+    ]
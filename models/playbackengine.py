@@ -0,0 +1,545 @@
+""" Class for presenting audio through one long-lived
+    sounddevice output stream. Both stimuli of a pair can be
+    loaded at once and switched without restarting playback.
+    Long signals can be streamed through a ring buffer instead
+    of being copied in full, and are resampled block by block
+    to the stream rate.
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+from scipy import signal as sps
+
+# Import system packages
+import math
+import queue
+import threading
+
+# Import audio packages
+import sounddevice as sd
+import soundfile as sf
+
+# Import custom modules
+from exceptions import audio_exceptions
+from models import devicecache
+from models import wavfile
+
+
+#########
+# BEGIN #
+#########
+class PlaybackEngine:
+    """ Output stream that is opened once and kept running.
+        Buffers are handed to the stream callback, so a new
+        presentation starts within one audio block.
+    """
+    def __init__(self, device_id, samplerate, blocksize=512):
+        # Assign variables
+        self.device_id = device_id
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+
+        # Currently playing buffer (read by the stream callback)
+        self._source = None
+        self.stream = None
+
+        # Loaded A/B pair (see load_pair)
+        self._pair = None
+        self._pair_buffers = ()
+
+        # Cross-fade ramps keyed by block length
+        self._ramps = dict()
+
+        # Exceptions from stream feeder threads (see get_errors)
+        self._errors = queue.Queue()
+
+        self.open()
+
+
+    def open(self):
+        """ Open and start the output stream using all output
+            channels of the audio device.
+        """
+        device = devicecache.get_device(self.device_id)
+        self.channels = device['max_output_channels']
+        try:
+            self.stream = sd.OutputStream(
+                device=self.device_id,
+                samplerate=self.samplerate,
+                channels=self.channels,
+                dtype='float32',
+                blocksize=self.blocksize,
+                latency='low',
+                callback=self._callback
+            )
+        except (sd.PortAudioError, ValueError):
+            print("playbackengine: Could not open audio device!")
+            raise audio_exceptions.InvalidAudioDevice(self.device_id)
+
+        self.stream.start()
+        print(f"playbackengine: Opened {device['name']} at " +
+              f"{self.samplerate} Hz ({self.channels} outputs)")
+
+
+    def close(self):
+        """ Stop and close the output stream.
+        """
+        self.stop()
+        self._pair = None
+        self._pair_buffers = ()
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+
+    def play(self, buffer, mapping, samplerate):
+        """ Present float32 BUFFER (samples x channels) routed to
+            the 1-based output channels in MAPPING. Replaces any
+            buffer that is currently playing.
+        """
+        self._check_samplerate(samplerate)
+        columns = self._get_columns(mapping)
+
+        # Hand the buffer to the callback (single assignment)
+        previous = self._source
+        self._source = _Source([buffer], columns)
+        self._end_stream(previous)
+
+
+    def play_stream(self, signal, gain, mapping, samplerate, num_blocks=32):
+        """ Present SIGNAL (samples x channels, any sample format,
+            or an open sf.SoundFile) multiplied by GAIN, routed to 
+            the 1-based outputs in MAPPING. Channels beyond MAPPING
+            are not played. Blocks are converted to float32 on a 
+            feeder thread and passed to the callback through a 
+            ring buffer of NUM_BLOCKS blocks, so memory use does 
+            not depend on signal length. A SoundFile is decoded 
+            one block at a time and closed when the stream ends.
+            A SAMPLERATE other than the stream rate is resampled
+            block by block, so the stream is not reopened.
+            Raises Clipping if the first blocks clip; later 
+            clipping stops the presentation and is reported by 
+            get_errors().
+        """
+        try:
+            columns = self._get_columns(mapping)
+            stream = _Stream(signal, gain, columns, self.blocksize, 
+                num_blocks, self._errors, samplerate, self.samplerate)
+        except Exception:
+            if isinstance(signal, sf.SoundFile):
+                signal.close()
+            raise
+
+        # Fill the ring before starting, so output begins without
+        # gaps (raises Clipping)
+        try:
+            stream.fill()
+        except audio_exceptions.Clipping:
+            stream.close_file()
+            raise
+
+        previous = self._source
+        self._source = stream
+        self._end_stream(previous)
+        stream.start()
+
+
+    def load_pair(self, buffers, mapping, samplerate):
+        """ Load the A and B BUFFERS of a pair (same number of 
+            channels) for switching with select(). Nothing plays 
+            until select() is called. Loading the same buffers 
+            again keeps the current playback position.
+        """
+        if (len(buffers) == len(self._pair_buffers)) and \
+            all(new is old for new, old in zip(buffers, self._pair_buffers)):
+            return
+
+        self.stop()
+        self._check_samplerate(samplerate)
+        columns = self._get_columns(mapping)
+        self._pair = _Source(buffers, columns)
+        self._pair_buffers = tuple(buffers)
+
+
+    def select(self, index, crossfade=False):
+        """ Switch to buffer INDEX (0 = A, 1 = B) of the loaded 
+            pair at the next block boundary, keeping the playback 
+            position. With CROSSFADE, the switch fades over one 
+            block instead of cutting. If the pair is not playing, 
+            it starts from the beginning.
+        """
+        pair = self._pair
+        if pair is None:
+            raise RuntimeError("playbackengine: No pair loaded")
+
+        if self._source is not pair:
+            pair.position = 0
+            pair.state = (index, None)
+            previous = self._source
+            self._source = pair
+            self._end_stream(previous)
+            return
+
+        active, _ = pair.state
+        if active != index:
+            pair.state = (index, active if crossfade else None)
+
+
+    def stop(self):
+        """ Stop the current presentation; the stream keeps running.
+        """
+        previous = self._source
+        self._source = None
+        self._end_stream(previous)
+
+
+    def get_errors(self):
+        """ Return list of exceptions raised on stream feeder
+            threads since the last call.
+        """
+        errors = []
+        while True:
+            try:
+                errors.append(self._errors.get_nowait())
+            except queue.Empty:
+                return errors
+
+
+    @property
+    def is_playing(self):
+        return self._source is not None
+
+
+    ################
+    # Helper Funcs #
+    ################
+    def _check_samplerate(self, samplerate):
+        """ Reopen the stream only if a buffer needs a different
+            sampling rate.
+        """
+        if samplerate != self.samplerate:
+            print(f"playbackengine: Reopening stream at {samplerate} Hz")
+            self.close()
+            self.samplerate = samplerate
+            self.open()
+
+
+    def _get_columns(self, mapping):
+        """ Convert 1-based routing to 0-based output columns.
+        """
+        columns = np.asarray(mapping, dtype=int) - 1
+        if (columns.min() < 0) or (columns.max() >= self.channels):
+            raise audio_exceptions.InvalidRouting(self.channels, mapping)
+        return columns
+
+
+    def _end_stream(self, source):
+        """ Stop the feeder thread of a replaced streamed source.
+        """
+        if isinstance(source, _Stream):
+            source.close()
+
+
+    def _get_ramp(self, frames):
+        """ Linear fade-in ramp (frames x 1) for cross-fading.
+        """
+        if frames not in self._ramps:
+            self._ramps[frames] = np.linspace(0, 1, frames,
+                dtype=np.float32).reshape(frames, 1)
+        return self._ramps[frames]
+
+
+    def _callback(self, outdata, frames, time, status):
+        """ Copy the next block of the current buffer to the
+            device outputs (runs on the audio thread).
+        """
+        outdata.fill(0)
+        source = self._source
+        if source is None:
+            return
+
+        if isinstance(source, _Stream):
+            # Release finished stream, unless it was already replaced
+            if (not source.read(outdata)) and (self._source is source):
+                self._source = None
+            return
+
+        start = source.position
+        stop = start + frames
+        active, fade_from = source.state
+        block = source.buffers[active][start:stop]
+
+        if fade_from is None:
+            outdata[:len(block), source.columns] = block
+        else:
+            # Fade from the previous buffer over this block
+            if source.state == (active, fade_from):
+                source.state = (active, None)
+            ramp = self._get_ramp(frames)
+            previous = source.buffers[fade_from][start:stop]
+            outdata[:len(block), source.columns] = block * ramp[:len(block)]
+            outdata[:len(previous), source.columns] += \
+                previous * (1 - ramp[:len(previous)])
+        source.position = stop
+
+        # Release finished buffer, unless it was already replaced
+        if (stop >= source.length) and (self._source is source):
+            self._source = None
+
+
+class _Source:
+    """ Buffers and playback position shared with the callback.
+        STATE holds (active buffer index, index to fade from).
+    """
+    __slots__ = ('buffers', 'columns', 'length', 'position', 'state')
+
+    def __init__(self, buffers, columns):
+        self.buffers = [buffer.reshape(len(buffer), -1) for buffer in buffers]
+        self.columns = columns
+        self.length = max(len(buffer) for buffer in self.buffers)
+        self.position = 0
+        self.state = (0, None)
+
+
+class _Resampler:
+    """ Polyphase resampler that converts a signal one chunk at 
+        a time, keeping the filter history between chunks so 
+        they join without clicks. Uses the filter of 
+        scipy.signal.resample_poly and gives the same result.
+    """
+    def __init__(self, fs, samplerate, num_channels):
+        factor = math.gcd(int(fs), int(samplerate))
+        self.up = int(samplerate) // factor
+        self.down = int(fs) // factor
+
+        max_rate = max(self.up, self.down)
+        self.delay = 10 * max_rate
+        taps = sps.firwin(2 * self.delay + 1, 1 / max_rate,
+            window=('kaiser', 5.0)) * self.up
+
+        # PHASES[p, k] is tap p + k * UP
+        self.num_taps = -(-len(taps) // self.up)
+        taps = np.pad(taps, (0, self.num_taps * self.up - len(taps)))
+        self.phases = np.ascontiguousarray(
+            taps.reshape(self.num_taps, self.up).T, dtype=np.float32)
+
+        # Last input frames (zeros before the signal starts)
+        self.history = np.zeros((self.num_taps - 1, num_channels),
+            dtype=np.float32)
+        self.consumed = 0
+        self.produced = 0
+
+
+    def output_length(self, frames):
+        """ Number of output frames for FRAMES input frames.
+        """
+        return -(-frames * self.up // self.down)
+
+
+    def process(self, chunk, limit=None):
+        """ Add CHUNK (frames x channels) and return the output 
+            frames that it completes (at most LIMIT in total).
+        """
+        ext = np.concatenate([self.history, 
+            np.asarray(chunk, dtype=np.float32)])
+        first_input = self.consumed - len(self.history)
+        self.consumed += len(chunk)
+        self.history = ext[len(ext) - len(self.history):]
+
+        # Outputs whose newest input frame has arrived
+        stop = (self.consumed * self.up - 1 - self.delay) // self.down + 1
+        if limit is not None:
+            stop = min(stop, limit)
+        if stop <= self.produced:
+            return ext[:0]
+        positions = np.arange(self.produced, stop) * self.down + self.delay
+        self.produced = stop
+
+        rows = (positions // self.up - first_input)[:, np.newaxis] - \
+            np.arange(self.num_taps)
+        return np.einsum('nk,nkc->nc', self.phases[positions % self.up],
+            ext[rows])
+
+
+    def flush(self):
+        """ Return the remaining output frames after the last 
+            chunk.
+        """
+        limit = self.output_length(self.consumed)
+        return self.process(
+            np.zeros((self.num_taps, self.history.shape[1])), limit)
+
+
+class _Stream:
+    """ Ring buffer between a feeder thread, which reads, 
+        resamples and scales blocks of the signal (an array or 
+        an open sf.SoundFile), and the stream callback. Only the
+        feeder advances WRITTEN and only the callback advances 
+        READ.
+    """
+    def __init__(self, signal, gain, columns, blocksize, num_blocks, errors,
+                 fs, samplerate):
+        self.columns = columns
+        self.blocksize = blocksize
+        self.errors = errors
+        num_channels = len(columns)
+
+        if isinstance(signal, sf.SoundFile):
+            # Decoded to float32 (+/-1) into one reused block
+            self.file = signal
+            self.signal = None
+            self.length = signal.frames
+            self.file_block = np.empty((blocksize, signal.channels),
+                dtype=np.float32)
+            full_scale = 1.0
+        else:
+            self.file = None
+            self.signal = signal.reshape(len(signal), -1)[:, :num_channels]
+            self.length = len(self.signal)
+            full_scale = wavfile.full_scale(signal.dtype)
+
+        # Convert samples to +/-1 and apply gain in one multiply
+        self.gain = np.float32(gain / full_scale)
+
+        # Resampled frames not yet written to the ring
+        self.input_position = 0
+        self.resampler = None
+        if fs != samplerate:
+            print(f"playbackengine: Streaming {fs} Hz audio at " +
+                  f"{samplerate} Hz")
+            self.resampler = _Resampler(fs, samplerate, num_channels)
+            self.length = self.resampler.output_length(self.length)
+            self.pending = np.zeros((0, num_channels), dtype=np.float32)
+            self.flushed = False
+
+        # Preallocated blocks and the number of valid frames in each
+        self.ring = np.zeros((num_blocks, blocksize, num_channels),
+            dtype=np.float32)
+        self.lengths = np.zeros(num_blocks, dtype=int)
+        self.written = 0
+        self.read_count = 0
+        self.position = 0
+        self.finished = False
+
+        # Set by the callback when a block is free
+        self.space = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True,
+            name='stream-feeder')
+        self.thread.start()
+
+
+    def close(self):
+        self.stopped.set()
+        self.space.set()
+
+
+    def close_file(self):
+        if self.file is not None:
+            self.file.close()
+
+
+    def fill(self):
+        """ Write blocks until the ring is full or the signal ends.
+            Raises Clipping if a scaled block exceeds +/-1.
+        """
+        num_blocks = len(self.ring)
+        while (not self.finished) and \
+            (self.written - self.read_count < num_blocks):
+            chunk = self._read_chunk()
+            if len(chunk) == 0:
+                # File shorter than its header says
+                self.finished = True
+                break
+            block = self.ring[self.written % num_blocks]
+            block[:len(chunk)] = chunk
+            block[:len(chunk)] *= self.gain
+
+            # Check before the block can be played
+            if max(block.max(), -block.min()) > 1:
+                self.finished = True
+                raise audio_exceptions.Clipping
+
+            self.lengths[self.written % num_blocks] = len(chunk)
+            self.position += len(chunk)
+            self.written += 1
+            if self.position >= self.length:
+                self.finished = True
+
+
+    def _read_chunk(self):
+        """ Next block of samples at the stream rate (BLOCKSIZE 
+            frames, except at the end).
+        """
+        if self.resampler is None:
+            return self._read_input()
+
+        while (len(self.pending) < self.blocksize) and \
+            (not self.flushed):
+            chunk = self._read_input()
+            if len(chunk) == 0:
+                resampled = self.resampler.flush()
+                self.flushed = True
+            else:
+                resampled = self.resampler.process(chunk)
+            self.pending = np.concatenate([self.pending, resampled])
+        chunk = self.pending[:self.blocksize]
+        self.pending = self.pending[self.blocksize:]
+        return chunk
+
+
+    def _read_input(self):
+        """ Next block of samples from the signal (at most 
+            BLOCKSIZE frames).
+        """
+        if self.file is None:
+            start = self.input_position
+            self.input_position += self.blocksize
+            return self.signal[start:start + self.blocksize]
+        chunk = self.file.read(self.blocksize, dtype='float32', 
+            always_2d=True, out=self.file_block)
+        return chunk[:, :self.ring.shape[2]]
+
+
+    def read(self, outdata):
+        """ Copy the next block to OUTDATA (runs on the audio
+            thread). Returns False once all blocks are played. 
+            If the feeder falls behind, the block is silent.
+        """
+        if self.read_count < self.written:
+            slot = self.read_count % len(self.ring)
+            frames = self.lengths[slot]
+            outdata[:frames, self.columns] = self.ring[slot, :frames]
+            self.read_count += 1
+            self.space.set()
+            return True
+        return not self.finished
+
+
+    def _run(self):
+        """ Keep the ring full until the signal ends or the stream
+            is closed (runs on the feeder thread).
+        """
+        try:
+            while not (self.finished or self.stopped.is_set()):
+                self.space.clear()
+                self.fill()
+                self.space.wait(timeout=0.1)
+        except audio_exceptions.Clipping as e:
+            print("playbackengine: Clipping while streaming; stopped")
+            self.errors.put(e)
+        except Exception as e:
+            # E.g., the file could not be read
+            print(f"playbackengine: Streaming stopped: {e}")
+            self.finished = True
+            self.errors.put(e)
+        finally:
+            self.close_file()
@@ -23,14 +23,24 @@ class SessionParsModel:
         'condition': {'type': 'str', 'value': 'TEST'},
         'randomize': {'type': 'int', 'value': 0},
         'repetitions': {'type': 'int', 'value': 1},
+        'random_seed': {'type': 'int', 'value': 0},
+        'no_repeats': {'type': 'int', 'value': 0},
+        'swap_ab': {'type': 'int', 'value': 0},
+        'block_by_category': {'type': 'int', 'value': 0},
 
         # Stimulus variables
         'audio_files_dir': {'type': 'str', 'value': 'Please select a folder'},
         'matrix_file_path': {'type': 'str', 'value': 'Please select a file'},
+        'stim_cache_MB': {'type': 'int', 'value': 1024},
+        'level_mode': {'type': 'str', 'value': 'raw'},
+        'match_ref_dB': {'type': 'float', 'value': -20.0},
 
         # Audio device variables
         'audio_device': {'type': 'int', 'value': 999},
         'channel_routing': {'type': 'str', 'value': '1'},
+        'audio_samplerate': {'type': 'int', 'value': 48000},
+        'switch_mode': {'type': 'str', 'value': 'restart'},
+        'stream_min_s': {'type': 'int', 'value': 60},
 
         # Calibration variables
         'cal_file': {'type': 'str', 'value': 'cal_stim.wav'},
@@ -42,6 +52,9 @@ class SessionParsModel:
         'adjusted_level_dB': {'type': 'float', 'value': -25.0},
         'desired_level_dB': {'type': 'float', 'value': 75},
 
+        # Seconds between config file saves during the task
+        'autosave_interval_s': {'type': 'int', 'value': 60},
+
         # Version control variables
         'config_file_status': {'type': 'int', 'value': 0},
         'check_for_updates': {'type': 'str', 'value': 'yes'},
@@ -67,6 +80,9 @@ class SessionParsModel:
         # Path to file
         self.filepath = directory / filename
 
+        # Track whether values have changed since last save
+        self.dirty = False
+
         # Attempt to load session parameters file
         self.load()
 
@@ -79,6 +95,7 @@ class SessionParsModel:
         if not self.filepath.exists():
             print("sessionmodel: No session parameters file found; " +
                   "using default values")
+            self.dirty = True
             return
 
         # Open the file and read in the raw values
@@ -102,12 +119,25 @@ class SessionParsModel:
 
 
     def save(self):
-        """ Save current session parameters to file 
+        """ Save current session parameters to file. Skipped if 
+            nothing has changed since the last save. The file is 
+            written to a temporary file first and then swapped in, 
+            so an interrupted write cannot corrupt the config file.
         """
-        # Write to JSON file
+        if not self.dirty:
+            return
+
+        # Write to temporary JSON file
         #print("sessionmodel: Writing session pars from model to file...")
-        with open(self.filepath, 'w') as fh:
+        temp_path = self.filepath.with_name(self.filepath.name + '.tmp')
+        with open(temp_path, 'w') as fh:
             json.dump(self.fields, fh)
+            fh.flush()
+            os.fsync(fh.fileno())
+
+        # Replace config file in a single step
+        os.replace(temp_path, self.filepath)
+        self.dirty = False
 
 
     def set(self, key, value):
@@ -119,6 +149,16 @@ class SessionParsModel:
             key in self.fields and 
             type(value).__name__ == self.fields[key]['type']
         ):
-            self.fields[key]['value'] = value
+            if self.fields[key]['value'] != value:
+                self.fields[key]['value'] = value
+                self.dirty = True
         else:
             raise ValueError("sessionmodel: Bad key or wrong variable type")
+
+
+    def update(self, values):
+        """ Set several variables from a dictionary of values. 
+            Values are not written to file until save() is called.
+        """
+        for key, value in values.items():
+            self.set(key, value)
@@ -0,0 +1,357 @@
+""" Class for keeping decoded audio files in memory. Files can 
+    be decoded ahead of time on a background thread, and 
+    resampled to the output device rate. Per-channel peaks are 
+    kept for each signal so clipping can be checked without 
+    scanning it.
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+from scipy import signal as sps
+
+# Import system packages
+import os
+import math
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Import audio packages
+import soundfile as sf
+
+# Import custom modules
+from models import wavfile
+from functions import levels
+
+
+#########
+# BEGIN #
+#########
+class StimulusCache:
+    """ Least-recently-used cache of audio arrays, limited by a 
+        total size in bytes. Memory-mapped arrays count their 
+        mapped size.
+    """
+    def __init__(self, max_bytes):
+        # Assign variables
+        self.max_bytes = int(max_bytes)
+        self.nbytes = 0
+
+        # Cached (signal, fs) tuples keyed by file path, or by 
+        # (file path, rate) for resampled signals
+        self._entries = OrderedDict()
+
+        # Per-channel peaks (re: full scale) keyed by (file path,
+        # rate); rate is None for the file's own rate. Kept after
+        # the signal is evicted.
+        self._peaks = dict()
+
+        # Background decoding
+        self._lock = threading.Lock()
+        self._pending = dict()
+        self._executor = None
+
+
+    def __contains__(self, path):
+        return os.fspath(path) in self._entries
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def get(self, path, samplerate=None):
+        """ Return (signal, fs) for the audio file at PATH. The
+            file is decoded only if it is not already cached. If 
+            SAMPLERATE is given and differs from the file rate, 
+            the signal is resampled to it (float32, +/-1) once 
+            and cached under (PATH, SAMPLERATE) only; the signal
+            at the file rate is not kept.
+        """
+        key = os.fspath(path)
+        with self._lock:
+            entry = self._lookup(key, samplerate)
+            if entry is not None:
+                return entry
+            future = self._pending.get(key)
+
+        if future is not None:
+            # Wait for a prefetch that is already in progress
+            future.result()
+            with self._lock:
+                entry = self._lookup(key, samplerate)
+            if entry is not None:
+                return entry
+
+        # Use the signal at the file rate if it is cached, without
+        # marking it as used: only the resampled signal is needed
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            signal, fs = self._read(key)
+            if (samplerate is None) or (fs == samplerate):
+                with self._lock:
+                    self._store(key, signal, fs)
+        else:
+            signal, fs = entry
+
+        if (samplerate is None) or (fs == samplerate):
+            return signal, fs
+        return self._get_resampled(key, signal, fs, samplerate)
+
+
+    def get_peaks(self, path, samplerate=None):
+        """ Return per-channel peak magnitudes (re: full scale) of
+            the signal get(PATH, SAMPLERATE) returns. Peaks are 
+            found once per signal; resampling can change them.
+        """
+        key = os.fspath(path)
+        with self._lock:
+            peaks = self._peaks.get((key, samplerate))
+        if peaks is not None:
+            return peaks
+
+        # Resampled peaks are stored when the signal is resampled, 
+        # so if there are none, SIGNAL is at the file's own rate
+        signal, fs = self.get(key, samplerate)
+        with self._lock:
+            peaks = self._peaks.get((key, samplerate))
+            if peaks is not None:
+                return peaks
+            peaks = self._peaks.get((key, None))
+        if peaks is None:
+            peaks = self._find_peaks(signal)
+        with self._lock:
+            self._peaks[(key, None)] = peaks
+            self._peaks[(key, samplerate)] = peaks
+        return peaks
+
+
+    def set_peaks(self, path, peaks):
+        """ Store known per-channel PEAKS of the file at PATH 
+            (e.g., from the stimulus index) at its own rate.
+        """
+        with self._lock:
+            self._peaks[(os.fspath(path), None)] = np.asarray(
+                peaks, dtype=np.float64)
+
+
+    def preload(self, paths, info=None, samplerate=None):
+        """ Read each unique file in PATHS into memory once, so 
+            the first presentation does not page samples in from 
+            disk. Files are resampled to SAMPLERATE, if given, 
+            as in get(). Stops early (without evicting) once the 
+            byte budget is full; remaining files are memory-mapped
+            on demand. INFO is an optional dict of (frames, 
+            channels, fs, itemsize) by path (see 
+            wavfile.sample_dtype).
+        """
+        info = info or dict()
+        for key in dict.fromkeys(os.fspath(path) for path in paths):
+            with self._lock:
+                if self._lookup(key, samplerate, touch=False) is not None:
+                    continue
+
+            if not os.access(key, os.F_OK):
+                print(f"stimuluscache: Skipping missing file: {key}")
+                continue
+
+            # Check the loaded size before reading the file
+            try:
+                details = info.get(key)
+                if details is None:
+                    file_info = sf.info(key)
+                    details = (file_info.frames, file_info.channels, 
+                        file_info.samplerate, 
+                        wavfile.sample_dtype(key).itemsize)
+                frames, channels, fs, itemsize = details
+                if (samplerate is not None) and (fs != samplerate):
+                    # Resampled signals are float32
+                    frames = math.ceil(frames * samplerate / fs)
+                    itemsize = np.dtype(np.float32).itemsize
+                size = frames * channels * itemsize
+                if self.nbytes + size > self.max_bytes:
+                    print("stimuluscache: Cache is full; remaining " +
+                          "files will be loaded on demand")
+                    break
+                signal, fs = self._read(key, load=True)
+            except RuntimeError as e:
+                print(f"stimuluscache: Skipping unreadable file: {key}: {e}")
+                continue
+
+            if (samplerate is None) or (fs == samplerate):
+                with self._lock:
+                    self._store(key, signal, fs)
+            else:
+                self._get_resampled(key, signal, fs, samplerate)
+
+        print(f"stimuluscache: {len(self)} file(s) cached " +
+              f"({round(self.nbytes / 1024**2, 1)} MB)")
+
+
+    def prefetch(self, paths, samplerate=None):
+        """ Decode (and resample to SAMPLERATE, if given) files in
+            PATHS on a background thread. Files that are cached or 
+            already queued are skipped. Errors are raised when the 
+            file is requested with get().
+        """
+        with self._lock:
+            for key in dict.fromkeys(os.fspath(path) for path in paths):
+                if (key in self._pending) or \
+                    (self._lookup(key, samplerate, touch=False) is not None):
+                    continue
+                self._pending[key] = self._get_executor().submit(
+                    self._prefetch_one, key, samplerate)
+
+
+    def submit(self, fn, *args):
+        """ Run FN(*ARGS) on the background thread, after any 
+            files already queued by prefetch() are decoded.
+        """
+        with self._lock:
+            return self._get_executor().submit(fn, *args)
+
+
+    def clear(self):
+        """ Remove all cached arrays.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._peaks.clear()
+            self.nbytes = 0
+
+
+    def shutdown(self):
+        """ Stop the background thread, discarding queued files.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+    ################
+    # Helper Funcs #
+    ################
+    def _read(self, key, load=False):
+        """ Read audio file (memory-mapped if possible; see 
+            wavfile.read). With LOAD, mapped samples are copied 
+            into memory. Cached arrays are read-only so callers
+            cannot modify them in place.
+        """
+        if not os.access(key, os.F_OK):
+            print(f"stimuluscache: Audio file not found: {key}")
+            raise FileNotFoundError(key)
+
+        signal, fs = wavfile.read(key)
+        if load and isinstance(signal, np.memmap):
+            signal = np.array(signal)
+        signal.flags.writeable = False
+        return signal, fs
+
+
+    def _lookup(self, key, samplerate, touch=True):
+        """ Return the cached (signal, fs) of KEY at SAMPLERATE (or 
+            at the file rate, if None), or None if not cached. With
+            TOUCH, the entry is marked as most recently used. Must 
+            be called while holding the lock.
+        """
+        for entry_key in (key, (key, samplerate)):
+            entry = self._entries.get(entry_key)
+            if (entry is not None) and \
+                (samplerate is None or entry[1] == samplerate):
+                if touch:
+                    self._entries.move_to_end(entry_key)
+                return entry
+        return None
+
+
+    def _get_executor(self):
+        """ Create the single background thread on first use.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='prefetch')
+        return self._executor
+
+
+    def _prefetch_one(self, key, samplerate):
+        """ Decode, resample and cache a single file (runs on the 
+            background thread).
+        """
+        try:
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is None:
+                signal, fs = self._read(key)
+            else:
+                signal, fs = entry
+            if (samplerate is None) or (fs == samplerate):
+                if entry is None:
+                    with self._lock:
+                        self._store(key, signal, fs)
+                return signal, fs
+            return self._get_resampled(key, signal, fs, samplerate)
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+
+    def _get_resampled(self, key, signal, fs, samplerate):
+        """ Return SIGNAL resampled from FS to SAMPLERATE, 
+            resampling only if it is not already cached.
+        """
+        resampled_key = (key, samplerate)
+        with self._lock:
+            if resampled_key in self._entries:
+                self._entries.move_to_end(resampled_key)
+                return self._entries[resampled_key]
+
+        print(f"stimuluscache: Resampling {os.path.basename(key)} " +
+              f"from {fs} to {samplerate} Hz")
+        factor = math.gcd(int(fs), int(samplerate))
+        resampled = sps.resample_poly(signal, samplerate // factor, 
+            fs // factor, axis=0).astype(np.float32)
+        resampled *= np.float32(1 / wavfile.full_scale(signal.dtype))
+        resampled.flags.writeable = False
+        peaks = self._find_peaks(resampled)
+
+        with self._lock:
+            self._store(resampled_key, resampled, samplerate)
+            self._peaks[resampled_key] = peaks
+        return resampled, samplerate
+
+
+    def _find_peaks(self, signal):
+        """ Per-channel peak magnitudes of SIGNAL, re: full scale.
+        """
+        signal = signal.reshape(len(signal), -1)
+        if len(signal) == 0:
+            return np.zeros(signal.shape[1])
+        peaks = levels.peak(signal, axis=0)
+        return np.asarray(peaks, dtype=np.float64) / \
+            wavfile.full_scale(signal.dtype)
+
+
+    def _store(self, key, signal, fs):
+        """ Add array to cache, evicting the least recently
+            used entries to stay within the byte budget. Must be 
+            called while holding the lock.
+        """
+        if signal.nbytes > self.max_bytes:
+            # Too large to ever fit: serve without caching
+            return
+
+        # Replace an entry stored meanwhile (e.g., by a prefetch)
+        old_entry = self._entries.pop(key, None)
+        if old_entry is not None:
+            self.nbytes -= old_entry[0].nbytes
+
+        self._entries[key] = (signal, fs)
+        self.nbytes += signal.nbytes
+
+        while self.nbytes > self.max_bytes:
+            _, (old_signal, _) = self._entries.popitem(last=False)
+            self.nbytes -= old_signal.nbytes
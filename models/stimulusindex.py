@@ -0,0 +1,162 @@
+""" Class for an on-disk index of audio file details. Each file
+    is scanned once (header details plus RMS, per-channel peak 
+    and loudness levels) and only scanned again when its 
+    modification time or size changes.
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+
+# Import system packages
+import os
+import sqlite3
+from collections import namedtuple
+
+# Import audio packages
+import soundfile as sf
+
+# Import custom modules
+from functions import levels
+
+
+#########
+# BEGIN #
+#########
+# Details stored for each audio file
+# (LOUDNESS is ungated K-weighted loudness in LKFS; None if silent.
+# CHANNEL_PEAKS is a tuple with one peak per channel.)
+IndexEntry = namedtuple('IndexEntry',
+    ['frames', 'channels', 'samplerate', 'subtype', 'rms', 'peak',
+     'loudness', 'channel_peaks'])
+
+
+class StimulusIndex:
+    """ SQLite database of audio file details, keyed by path.
+        DB_PATH: database file; created if it does not exist.
+    """
+    # Increase when the table layout changes (rebuilds the index)
+    SCHEMA_VERSION = 3
+
+    def __init__(self, db_path, blocksize=65536):
+        # Assign variables
+        self.db_path = db_path
+        self.blocksize = blocksize
+
+        print(f"\nstimulusindex: Opening {os.path.basename(db_path)}")
+        self.db = sqlite3.connect(db_path)
+        self._create_table()
+
+
+    def __contains__(self, path):
+        return self.get(path) is not None
+
+
+    def get(self, path):
+        """ Return IndexEntry for PATH, or None if it is not in
+            the index.
+        """
+        row = self.db.execute(
+            "SELECT frames, channels, samplerate, subtype, rms, peak, "
+            "loudness, channel_peaks FROM files WHERE path = ?", 
+            (os.fspath(path),)
+        ).fetchone()
+        if row is None:
+            return None
+        channel_peaks = tuple(np.frombuffer(row[-1], dtype=np.float64))
+        return IndexEntry(*row[:-1], channel_peaks)
+
+
+    def refresh(self, paths):
+        """ Bring the index up to date for PATHS. New or changed
+            files are scanned; missing files are removed. Returns
+            the number of files scanned.
+        """
+        stored = dict(
+            (path, (mtime, size)) for path, mtime, size in
+            self.db.execute("SELECT path, mtime_ns, size FROM files")
+        )
+
+        updates = []
+        removed = []
+        for path in dict.fromkeys(os.fspath(path) for path in paths):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                if path in stored:
+                    removed.append((path,))
+                continue
+
+            if stored.get(path) == (stat.st_mtime_ns, stat.st_size):
+                continue
+
+            try:
+                entry = self._scan(path)
+            except RuntimeError as e:
+                print(f"stimulusindex: Cannot read {path}: {e}")
+                continue
+            updates.append((path, stat.st_mtime_ns, stat.st_size) + 
+                entry[:-1] + (np.array(entry.channel_peaks).tobytes(),))
+
+        # Write all changes in one transaction
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+                updates)
+            self.db.executemany("DELETE FROM files WHERE path = ?", removed)
+
+        print(f"stimulusindex: Scanned {len(updates)} file(s), " +
+              f"removed {len(removed)}")
+        return len(updates)
+
+
+    def close(self):
+        self.db.close()
+
+
+    ################
+    # Helper Funcs #
+    ################
+    def _create_table(self):
+        """ Create the files table, replacing any table with an
+            old layout.
+        """
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        with self.db:
+            if version != self.SCHEMA_VERSION:
+                self.db.execute("DROP TABLE IF EXISTS files")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, "
+                "frames INTEGER, channels INTEGER, samplerate INTEGER, "
+                "subtype TEXT, rms REAL, peak REAL, loudness REAL, "
+                "channel_peaks BLOB)"
+            )
+            self.db.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+
+    def _scan(self, path):
+        """ Read header details and compute the RMS, per-channel 
+            peak and loudness of all samples, one block at a time.
+        """
+        info = sf.info(path)
+        sum_squares = 0.0
+        weighted_squares = np.zeros(info.channels)
+        zi = None
+        peaks = np.zeros(info.channels)
+        for block in sf.blocks(path, blocksize=self.blocksize, 
+                always_2d=True):
+            sum_squares += float(np.dot(block.ravel(), block.ravel()))
+            np.maximum(peaks, levels.peak(block, axis=0), out=peaks)
+            weighted, zi = levels.k_weight(block, info.samplerate, zi)
+            weighted_squares += np.square(weighted).sum(axis=0)
+
+        num_samples = info.frames * info.channels
+        rms = np.sqrt(sum_squares / num_samples) if num_samples else 0.0
+        loudness = levels.loudness(weighted_squares / max(info.frames, 1))
+        return IndexEntry(info.frames, info.channels, info.samplerate,
+            info.subtype, float(rms), float(np.max(peaks, initial=0)), 
+            float(loudness) if np.isfinite(loudness) else None,
+            tuple(peaks.tolist()))
@@ -2,50 +2,305 @@
 """
 
 # Import data science packages
+import numpy as np
 import pandas as pd
 
 # Import system packages
-import random
+import io
 import os
+import hashlib
+import zipfile
+from collections import namedtuple
 from pathlib import Path
 
+# Import audio packages
+import soundfile as sf
+
+# Import custom modules
+from models.stimuluscache import StimulusCache
+from models import wavfile
+from functions import levels
+from exceptions import audio_exceptions
+
 
 #########
 # BEGIN #
 #########
+# Matrix file columns and their types
+MATRIX_SCHEMA = {
+    'audio_A': str,
+    'audio_B': str,
+    'pres_level': np.float64,
+    'instructions': str,
+    'image': str,
+    'category': 'category',
+}
+
+# One trial from the matrix file (see StimulusModel.trial)
+Trial = namedtuple('Trial', MATRIX_SCHEMA)
+
+
+class Randomizer:
+    """ Seeded trial order generator with optional constraints.
+        SEED: seed for the NumPy random number generator; the same
+            seed and inputs always give the same order.
+        NO_REPEATS: never present the same matrix row twice in a row.
+    """
+    def __init__(self, seed, no_repeats=False):
+        self.seed = seed
+        self.no_repeats = no_repeats
+        self.rng = np.random.default_rng(seed)
+
+
+    def shuffle(self, rows, groups=None):
+        """ Return a permutation of positions for the trials in
+            ROWS (array of matrix row indices). If GROUPS (one 
+            label per trial) is given, trials are presented in 
+            blocks of the same label, with blocks in random order.
+        """
+        if groups is None:
+            return self._shuffle_block(rows, np.arange(len(rows)))
+
+        # Random block order, then shuffle within each block
+        labels = pd.unique(groups)
+        perm = [
+            self._shuffle_block(rows, np.flatnonzero(groups == label))
+            for label in self.rng.permutation(labels)
+        ]
+        return np.concatenate(perm)
+
+
+    def _shuffle_block(self, rows, positions):
+        """ Shuffle POSITIONS, then repair back-to-back repeats if
+            requested.
+        """
+        perm = self.rng.permutation(positions)
+        if self.no_repeats:
+            perm = self._remove_repeats(rows, perm)
+        return perm
+
+
+    def _remove_repeats(self, rows, perm, max_passes=2):
+        """ Swap trials until no row follows itself. Repeats are 
+            rare after shuffling, so only those positions are 
+            visited. When repeats are dense (few rows with many 
+            repetitions), or swapping stops helping, the order is
+            constructed directly instead.
+        """
+        n = len(perm)
+        seq = rows[perm]
+        repeats = np.flatnonzero(seq[1:] == seq[:-1]) + 1
+        if repeats.size * 8 > n:
+            return self._construct_without_repeats(rows, perm)
+
+        for _ in range(max_passes):
+            if repeats.size == 0:
+                return perm
+
+            for ii in repeats:
+                if rows[perm[ii]] != rows[perm[ii-1]]:
+                    # Already fixed by an earlier swap
+                    continue
+                # Try random partners; keep the first valid swap
+                for jj in self.rng.integers(0, n, size=16):
+                    perm[ii], perm[jj] = perm[jj], perm[ii]
+                    if self._no_repeat_near(rows, perm, (ii, jj)):
+                        break
+                    perm[ii], perm[jj] = perm[jj], perm[ii]
+
+            seq = rows[perm]
+            remaining = np.flatnonzero(seq[1:] == seq[:-1]) + 1
+            if remaining.size >= repeats.size:
+                break
+            repeats = remaining
+
+        if repeats.size == 0:
+            return perm
+        return self._construct_without_repeats(rows, perm)
+
+
+    def _no_repeat_near(self, rows, perm, positions):
+        """ True if no repeats occur next to POSITIONS.
+        """
+        for pos in positions:
+            for left in (pos - 1, pos):
+                if (left >= 0) and (left + 1 < len(perm)) and \
+                    rows[perm[left]] == rows[perm[left + 1]]:
+                    return False
+        return True
+
+
+    def _construct_without_repeats(self, rows, perm):
+        """ Build the order one trial at a time, choosing a random
+            row (weighted by how often it remains) that differs 
+            from the previous one. A row that fills half of the 
+            remaining trials must be chosen next to stay feasible.
+            Only used when rows are few, so the choice is a short
+            loop over row counts.
+        """
+        values, counts = np.unique(rows[perm], return_counts=True)
+        if counts.max() * 2 > len(perm) + 1:
+            raise audio_exceptions.InvalidTrialOrder(
+                "Too many repetitions of one stimulus pair to avoid " +
+                "back-to-back repeats")
+
+        # Positions still available for each row
+        pools = [
+            list(self.rng.permutation(perm[rows[perm] == value])) 
+            for value in values
+        ]
+        counts = counts.tolist()
+        draws = self.rng.random(len(perm)).tolist()
+        result = []
+        previous = -1
+        for remaining, draw in zip(range(len(perm), 0, -1), draws):
+            biggest = max(range(len(counts)), key=counts.__getitem__)
+            if counts[biggest] * 2 > remaining:
+                choice = biggest
+            else:
+                # Weighted choice, excluding the previous row
+                total = remaining - (counts[previous] if previous >= 0 
+                    else 0)
+                target = draw * total
+                for choice, count in enumerate(counts):
+                    if choice == previous:
+                        continue
+                    target -= count
+                    if target < 0:
+                        break
+                else:
+                    # Rounding: take the last row still available
+                    choice = max(ii for ii, count in enumerate(counts) 
+                        if count and ii != previous)
+            result.append(pools[choice].pop())
+            counts[choice] -= 1
+            previous = choice
+        return np.array(result)
+
+
 class StimulusModel:
-    def __init__(self, sessionpars):
+    """ Trials are stored as an array of row indices into the 
+        matrix file (self.order). self.trials holds the Trial 
+        record for each trial in presentation order.
+        SEED: seed for randomizing trial order. A new seed is 
+            drawn if not provided. Stored in self.seed so the 
+            order can be reproduced.
+        INDEX: optional StimulusIndex. It is refreshed for the 
+            audio files in the matrix and supplies their details
+            without decoding.
+    """
+    def __init__(self, sessionpars, seed=None, index=None):
         
         # Assign variables
         self.sessionpars = sessionpars
+        self.index = index
+        if seed is None:
+            seed = int(np.random.SeedSequence().generate_state(1)[0])
+        self.seed = seed
 
         #####################
         # Sequence of Funcs #
         #####################
-        # Import matrix file and add full audio paths
+        # Import matrix file with full audio paths and audio
+        # file details (from the compiled matrix, if valid)
         self._load_matrix()
-        self._add_full_audio_paths()
+        self._build_records()
+
+        # Decode audio files named in the matrix
+        self._build_cache()
+        self._get_peaks()
+
+        # Per-file gains for the level mode in sessionpars
+        self._get_level_compensation()
 
         # Make trial repetitions
         self._do_reps()
 
+        # If specified, present half of each row's repetitions 
+        # with A and B swapped
+        self.swapped = np.zeros(len(self.order), dtype=bool)
+        if self.sessionpars['swap_ab'].get() == 1:
+            self._balance_positions()
+
         # If specified, randomize trials
         if self.sessionpars['randomize'].get() == 1:
             self._randomize()
 
+        # Look up every trial once
+        self._build_trials()
+
 
     def _load_matrix(self):
+        """ Load the compiled matrix file if it matches the matrix 
+            file contents and audio directory. Otherwise parse the 
+            matrix file and write a new compiled matrix.
+        """
+        matrix_path = self.sessionpars['matrix_file_path'].get()
         try:
             print('\nstimulusmodel: Reading matrix file')
+            with open(matrix_path, 'rb') as fh:
+                data = fh.read()
+        except FileNotFoundError:
+            print('stimulusmodel: File not found!')
+            raise
+
+        compiled_path = Path(matrix_path).with_suffix('.compiled.npz')
+        key = self._get_matrix_key(data)
+        if self._load_compiled(compiled_path, key):
+            self._refresh_index()
+            return
+
+        self._parse_matrix(data)
+        self._add_full_audio_paths()
+        self._get_audio_info()
+        self._save_compiled(compiled_path, key)
+
+
+    def _get_matrix_key(self, data):
+        """ Hash of the matrix file contents, audio directory path
+            and audio directory modification time.
+        """
+        audio_dir = self.sessionpars['audio_files_dir'].get()
+        try:
+            mtime = os.stat(audio_dir).st_mtime_ns
+        except OSError:
+            mtime = 0
+        key = hashlib.sha256(data)
+        key.update(f"\n{audio_dir}\n{mtime}".encode())
+        return key.hexdigest()
+
+
+    def _parse_matrix(self, data):
+        """ Parse matrix file DATA using MATRIX_SCHEMA. Columns are 
+            bound by position (the header text is not checked) and 
+            typed while parsing; extra columns are ignored. Raises 
+            InvalidMatrixFile if there are too few columns or a 
+            value has the wrong type.
+        """
+        try:
+            num_columns = len(pd.read_csv(io.BytesIO(data), nrows=0).columns)
+            if num_columns < len(MATRIX_SCHEMA):
+                raise ValueError(
+                    f"expected at least {len(MATRIX_SCHEMA)} columns " +
+                    f"({', '.join(MATRIX_SCHEMA)}), found {num_columns}")
+
             # Create private attribute of raw matrix file
             self._matrix_file = pd.read_csv(
-                self.sessionpars['matrix_file_path'].get()
+                io.BytesIO(data),
+                header=0,
+                names=list(MATRIX_SCHEMA),
+                usecols=range(len(MATRIX_SCHEMA)),
+                dtype=MATRIX_SCHEMA,
+                engine='c'
             )
-            self._matrix_file['pres_level'].astype(float)
+        except (ValueError, pd.errors.EmptyDataError) as e:
+            print('stimulusmodel: Invalid matrix file!')
+            raise audio_exceptions.InvalidMatrixFile(str(e))
 
-        except FileNotFoundError:
-            print('stimulusmodel: File not found!')
-            raise
+        # Empty text cells are read as NaN
+        for col, dtype in MATRIX_SCHEMA.items():
+            if dtype is str:
+                self._matrix_file[col] = self._matrix_file[col].fillna('')
 
 
     def _add_full_audio_paths(self):
@@ -55,40 +310,286 @@ class StimulusModel:
         # Get audio files directory
         audio_dir = Path(self.sessionpars['audio_files_dir'].get())
 
-        for row in self._matrix_file.index:
-            # AUDIO A
-            # Create full path to audio file
-            full_path = os.path.join(
-                audio_dir, self._matrix_file.iloc[row,0]
-            )
-            # Update name in _matrix_file df
-            self._matrix_file.iloc[row,0] = full_path
+        for col in ['audio_A', 'audio_B', 'image']:
+            names = self._matrix_file[col]
+            # Join each unique name once, then map onto the column
+            full_paths = {
+                name: os.path.join(audio_dir, name) 
+                for name in pd.unique(names)
+            }
+            self._matrix_file[col] = names.map(full_paths)
 
-            # AUDIO B
-            # Create full path to audio file
-            full_path = os.path.join(
-                audio_dir, self._matrix_file.iloc[row,1]
-            )
-            # Update name in _matrix_file df
-            self._matrix_file.iloc[row,1] = full_path
 
-            # AUDIO B
-            # Create full path to audio file
-            full_path = os.path.join(
-                audio_dir, self._matrix_file.iloc[row,4]
-            )
-            # Update name in _matrix_file df
-            self._matrix_file.iloc[row,4] = full_path
+    def _refresh_index(self):
+        """ Scan new or changed audio files into the stimulus index.
+        """
+        if self.index is not None:
+            self.index.refresh(pd.unique(self._audio_paths()))
+
+
+    def _get_audio_info(self):
+        """ Read the length, channels, sampling rate and bytes per
+            sample in memory (see wavfile.sample_dtype) of each 
+            audio file in the matrix. Missing or unreadable files 
+            are left out.
+        """
+        self.audio_info = dict()
+        if self.index is not None:
+            self._refresh_index()
+            for path in pd.unique(self._audio_paths()):
+                entry = self.index.get(path)
+                if entry is not None:
+                    self.audio_info[path] = (entry.frames, entry.channels,
+                        entry.samplerate, 
+                        wavfile.sample_dtype(path).itemsize)
+            return
+
+        for path in pd.unique(self._audio_paths()):
+            try:
+                info = sf.info(path)
+            except RuntimeError:
+                continue
+            self.audio_info[path] = (info.frames, info.channels,
+                info.samplerate, wavfile.sample_dtype(path).itemsize)
+
+
+    def _load_compiled(self, compiled_path, key):
+        """ Restore the matrix and audio file details from
+            COMPILED_PATH. Returns False if the file is missing,
+            unreadable or does not match KEY.
+        """
+        try:
+            with np.load(compiled_path, allow_pickle=False) as compiled:
+                if str(compiled['key']) != key:
+                    return False
+
+                matrix = {
+                    col: compiled[col] for col, dtype in 
+                    MATRIX_SCHEMA.items() if dtype != 'category'
+                }
+                matrix['category'] = pd.Categorical.from_codes(
+                    compiled['category_codes'], 
+                    compiled['category_values']
+                )
+                self._matrix_file = pd.DataFrame(matrix, 
+                    columns=list(MATRIX_SCHEMA)).astype(MATRIX_SCHEMA)
+
+                # Files from older versions lack bytes per sample
+                info_values = compiled['info_values']
+                if info_values.shape[1:] != (4,):
+                    return False
+                self.audio_info = {
+                    path: tuple(int(value) for value in row)
+                    for path, row in zip(compiled['info_paths'].tolist(),
+                        info_values)
+                }
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            return False
+
+        print('stimulusmodel: Loaded compiled matrix file')
+        return True
+
+
+    def _save_compiled(self, compiled_path, key):
+        """ Write the typed matrix and audio file details to 
+            COMPILED_PATH for the next session. Failure to write 
+            is not an error.
+        """
+        matrix = self._matrix_file
+        arrays = {
+            col: matrix[col].to_numpy(dtype=(str if dtype is str else dtype))
+            for col, dtype in MATRIX_SCHEMA.items() 
+            if dtype != 'category'
+        }
+        arrays['category_codes'] = matrix['category'].cat.codes.to_numpy()
+        arrays['category_values'] = \
+            matrix['category'].cat.categories.to_numpy(dtype=str)
+        arrays['info_paths'] = np.array(list(self.audio_info), dtype=str)
+        arrays['info_values'] = np.array(list(self.audio_info.values()),
+            dtype=np.int64).reshape(-1, 4)
+
+        temp_path = compiled_path.with_name(compiled_path.name + '.tmp')
+        try:
+            with open(temp_path, 'wb') as fh:
+                np.savez(fh, key=np.array(key), **arrays)
+            os.replace(temp_path, compiled_path)
+        except OSError as e:
+            print(f"stimulusmodel: Could not save compiled matrix: {e}")
+
+
+    def _build_records(self):
+        """ Create one Trial record per matrix file row.
+        """
+        self._records = [
+            Trial._make(row) for row in 
+            self._matrix_file.itertuples(index=False, name=None)
+        ]
+
+
+    def check_audio_files(self):
+        """ Check that every audio file in the matrix exists and 
+            can be read. Raises MissingAudioFiles listing all 
+            missing and unreadable files.
+        """
+        print('stimulusmodel: Checking audio files')
+        missing = []
+        unreadable = []
+        for path in pd.unique(self._audio_paths()):
+            if not os.path.isfile(path):
+                missing.append(path)
+            elif path not in self.audio_info:
+                # Header could not be read (see _get_audio_info)
+                unreadable.append(path)
+        if missing or unreadable:
+            print(f'stimulusmodel: {len(missing)} audio file(s) not ' +
+                  f'found, {len(unreadable)} unreadable')
+            raise audio_exceptions.MissingAudioFiles(missing, unreadable)
+
+
+    def _build_cache(self):
+        """ Read every unique audio file in the matrix once and 
+            keep the arrays in memory, up to the cache size 
+            specified in sessionpars. Arrays are resampled to the 
+            output rate (audio_samplerate) here, not during the 
+            task. Stimuli long enough to be streamed (stream_min_s,
+            in 'restart' switch mode) are not preloaded; they are 
+            memory-mapped when played.
+        """
+        max_bytes = self.sessionpars['stim_cache_MB'].get() * 1024**2
+        self.cache = StimulusCache(max_bytes)
+
+        stream_min_s = float('inf')
+        if self.sessionpars['switch_mode'].get() == 'restart':
+            stream_min_s = self.sessionpars['stream_min_s'].get()
+        paths = [
+            path for path in pd.unique(self._audio_paths())
+            if not (self.duration(path) or 0) >= stream_min_s
+        ]
+
+        print('stimulusmodel: Preloading audio files')
+        self.cache.preload(paths, info=self.audio_info,
+            samplerate=self.sessionpars['audio_samplerate'].get())
+
+
+    def _get_peaks(self):
+        """ Give the cache the per-channel peaks of each indexed 
+            audio file, so clipping checks do not scan the audio. 
+            Peaks of other files are found by the cache on request.
+        """
+        if self.index is None:
+            return
+        for path in pd.unique(self._audio_paths()):
+            entry = self.index.get(path)
+            if entry is not None:
+                self.cache.set_peaks(path, entry.channel_peaks)
+
+
+    def check_clipping(self, slm_offset):
+        """ Check every matrix row for clipping at its presentation
+            level, the SLM_OFFSET (dB) and each file's level 
+            matching gain, using the files' peaks. Raises 
+            ClippingTrials listing (row, path, dB over full scale)
+            for each file that would clip. Missing files are left
+            to check_audio_files.
+        """
+        print('stimulusmodel: Checking trials for clipping')
+        peak_dB = dict()
+        for path in pd.unique(self._audio_paths()):
+            try:
+                peak = np.max(self.cache.get_peaks(path), initial=0)
+            except (FileNotFoundError, RuntimeError):
+                continue
+            peak_dB[path] = levels.mag2db(peak) if peak > 0 else -np.inf
+
+        clipping = []
+        for row, trial in enumerate(self._records, start=1):
+            level = trial.pres_level - slm_offset
+            for path in (trial.audio_A, trial.audio_B):
+                over = level + self.level_compensation(path) + \
+                    peak_dB.get(path, -np.inf)
+                if over > 0:
+                    clipping.append((row, path, round(float(over), 2)))
+
+        if clipping:
+            print(f'stimulusmodel: {len(clipping)} stimulus ' +
+                  'presentation(s) would clip')
+            raise audio_exceptions.ClippingTrials(clipping)
+
+
+    def duration(self, path):
+        """ Duration (s) of the audio file at PATH, or None if it 
+            is missing or unreadable.
+        """
+        info = self.audio_info.get(path)
+        if info is None:
+            return None
+        frames, _, fs, _ = info
+        return frames / fs
+
+
+    def _audio_paths(self):
+        """ All A and B audio paths, row by row.
+        """
+        return self._matrix_file[['audio_A', 'audio_B']].to_numpy().ravel()
+
+
+    def _get_level_compensation(self):
+        """ Find the gain (dB) that brings each audio file to the
+            reference level in sessionpars: 'rms' matches RMS 
+            (dB FS), 'loudness' matches K-weighted loudness (LKFS),
+            'raw' applies no gain. Missing or silent files get no
+            gain.
+        """
+        self._level_compensation = dict()
+        mode = self.sessionpars['level_mode'].get()
+        if mode == 'raw':
+            return
+
+        print(f'stimulusmodel: Matching file levels ({mode})')
+        reference = self.sessionpars['match_ref_dB'].get()
+        for path in pd.unique(self._audio_paths()):
+            measured = self._measure_level(path, mode)
+            if measured is not None:
+                self._level_compensation[path] = reference - measured
+
+
+    def _measure_level(self, path, mode):
+        """ Return the RMS (dB FS) or loudness (LKFS) of the file 
+            at PATH from the stimulus index. Files that are not 
+            indexed are measured from the decoded audio.
+        """
+        entry = self.index.get(path) if self.index is not None else None
+        if entry is not None:
+            if mode == 'rms':
+                return levels.mag2db(entry.rms) if entry.rms > 0 else None
+            return entry.loudness
+
+        try:
+            signal, fs = self.cache.get(path)
+        except (FileNotFoundError, RuntimeError):
+            return None
+        signal = signal.reshape(len(signal), -1) / \
+            wavfile.full_scale(signal.dtype)
+        if mode == 'rms':
+            rms = levels.rms(signal)
+            return levels.mag2db(rms) if rms > 0 else None
+        weighted, _ = levels.k_weight(signal, fs)
+        loudness = levels.loudness(np.mean(np.square(weighted), axis=0))
+        return loudness if np.isfinite(loudness) else None
+
+
+    def level_compensation(self, path):
+        """ Gain (dB) to add to the presentation level of the 
+            audio file at PATH.
+        """
+        return self._level_compensation.get(path, 0.0)
 
 
     def _do_reps(self):
         """ Repeat matrix file trials according to the number 
-            specified in File>Session.
+            specified in File>Session. Only row indices are 
+            repeated; the matrix itself is not copied.
         """
-        # Create a copy of private raw matrix import
-        # to preserve it and avoid multiple versions issues
-        self.matrix = self._matrix_file.copy()
-
         # Make sure there is at least 1 'repetition'
         if (self.sessionpars['repetitions'].get() == 0) or \
             (self.sessionpars['repetitions'].get() == None):
@@ -96,30 +597,75 @@ class StimulusModel:
 
         # Create repeated trials
         print('stimulusmodel: Creating trial repetitions')        
-        self.matrix = pd.concat(
-            [self.matrix] * self.sessionpars['repetitions'].get(), 
-            ignore_index=True
+        self.order = np.tile(
+            np.arange(self._matrix_file.shape[0]),
+            self.sessionpars['repetitions'].get()
         )
 
 
+    def _balance_positions(self):
+        """ Swap A and B on alternate repetitions of each row. 
+            Which repetitions are swapped is chosen per row using
+            the seed.
+        """
+        print('stimulusmodel: Balancing A/B positions')
+        rng = np.random.default_rng([self.seed, 1])
+        num_rows = self._matrix_file.shape[0]
+        repetition = np.arange(len(self.order)) // num_rows
+        offset = rng.integers(0, 2, size=num_rows)
+        self.swapped = (repetition + offset[self.order]) % 2 == 1
+
+
     def _randomize(self):
-        """ Randomize trials in self.matrix.
+        """ Randomize trial order using a seeded random number
+            generator, applying any constraints from sessionpars.
         """
-        print('stimulusmodel: Randomizing trials')
-        # Get trial numbers from matrix df index
-        trials = list(self.matrix.index)
+        print(f'stimulusmodel: Randomizing trials (seed: {self.seed})')
+        randomizer = Randomizer(
+            self.seed,
+            no_repeats=(self.sessionpars['no_repeats'].get() == 1)
+        )
+
+        # Optionally present trials in blocks by category
+        groups = None
+        if self.sessionpars['block_by_category'].get() == 1:
+            codes = self._matrix_file['category'].cat.codes.to_numpy()
+            groups = codes[self.order]
 
-        # Shuffle (in place)
-        random.shuffle(trials)
+        perm = randomizer.shuffle(self.order, groups)
+        self.order = self.order[perm]
+        self.swapped = self.swapped[perm]
 
-        # Create new df column with shuffled trial order
-        self.matrix['order'] = trials
 
-        # Sort by new order column
-        self.matrix.sort_values(by='order', inplace=True)
+    ##########
+    # Trials #
+    ##########
+    def _build_trials(self):
+        """ Create the immutable sequence of Trial records in 
+            presentation order. Records are shared between 
+            repetitions of the same matrix row.
+        """
+        swapped_records = [
+            record._replace(audio_A=record.audio_B, audio_B=record.audio_A)
+            for record in self._records
+        ]
+        self.trials = tuple(
+            swapped_records[row] if swap else self._records[row]
+            for row, swap in zip(self.order.tolist(), self.swapped.tolist())
+        )
 
-        # Remove order column
-        self.matrix.drop('order', axis=1, inplace=True)
 
-        # Reset index
-        self.matrix.reset_index(drop=True, inplace=True)
+    @property
+    def num_trials(self):
+        return len(self.trials)
+
+
+    @property
+    def matrix(self):
+        """ All trials in presentation order as a DataFrame. Built
+            on request; not needed to run trials.
+        """
+        matrix = self._matrix_file.iloc[self.order].reset_index(drop=True)
+        matrix.loc[self.swapped, ['audio_A', 'audio_B']] = \
+            matrix.loc[self.swapped, ['audio_B', 'audio_A']].to_numpy()
+        return matrix
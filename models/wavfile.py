@@ -0,0 +1,172 @@
+""" Functions for reading .wav files without decoding them.
+    Plain PCM and float WAV data is memory-mapped in its native
+    sample format; other files are decoded by soundfile.
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+
+# Import system packages
+import os
+import struct
+
+# Import audio packages
+import soundfile as sf
+
+# Import custom modules
+from exceptions import audio_exceptions
+
+
+#########
+# BEGIN #
+#########
+# Format tags from the 'fmt ' chunk
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Sample formats that map directly onto a NumPy dtype
+_DTYPES = {
+    (WAVE_FORMAT_PCM, 16): np.dtype('<i2'),
+    (WAVE_FORMAT_PCM, 32): np.dtype('<i4'),
+    (WAVE_FORMAT_IEEE_FLOAT, 32): np.dtype('<f4'),
+    (WAVE_FORMAT_IEEE_FLOAT, 64): np.dtype('<f8'),
+}
+
+
+def read(path):
+    """ Return (signal, fs) for the audio file at PATH. WAV files
+        with 16/32-bit integer or 32/64-bit float samples are
+        memory-mapped (read-only, native dtype); anything else is
+        decoded to float64 by soundfile. Mono signals are 1-D, as
+        with sf.read.
+    """
+    try:
+        return read_mapped(path)
+    except audio_exceptions.UnsupportedWavFormat:
+        return sf.read(path)
+
+
+def read_mapped(path):
+    """ Memory-map the sample data of the WAV file at PATH.
+        Raises UnsupportedWavFormat if the samples cannot be
+        mapped directly.
+    """
+    dtype, channels, fs, data_offset, frames = _get_layout(path)
+    signal = np.memmap(path, dtype=dtype, mode='r', offset=data_offset,
+        shape=(frames, channels))
+    if channels == 1:
+        signal = signal.reshape(frames)
+    return signal, fs
+
+
+def sample_dtype(path):
+    """ Dtype of the array read() returns for the file at PATH, 
+        from the file header only: the native dtype for files 
+        that can be mapped, otherwise float64.
+    """
+    try:
+        return _get_layout(path)[0]
+    except audio_exceptions.UnsupportedWavFormat:
+        return np.dtype(np.float64)
+
+
+def full_scale(dtype):
+    """ Value of digital full scale for samples of DTYPE.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'i':
+        return float(2 ** (8 * dtype.itemsize - 1))
+    return 1.0
+
+
+def to_float32(signal, blocksize=262144):
+    """ Return a float32 copy of SIGNAL scaled to +/-1. Integer
+        samples are converted one block at a time, so no float64
+        copy of the whole signal is made.
+    """
+    out = np.empty(signal.shape, dtype=np.float32)
+    scale = np.float32(1 / full_scale(signal.dtype))
+    for start in range(0, len(signal), blocksize):
+        block = out[start:start + blocksize]
+        block[...] = signal[start:start + blocksize]
+        if scale != 1:
+            block *= scale
+    return out
+
+
+################
+# Helper Funcs #
+################
+def _get_layout(path):
+    """ Return (dtype, channels, fs, data offset, frames) for 
+        mapping the samples of the WAV file at PATH. Raises 
+        UnsupportedWavFormat if they cannot be mapped directly.
+    """
+    with open(path, 'rb') as fh:
+        fmt, data_offset, data_size = _parse_chunks(fh)
+
+    format_tag, channels, fs, block_align, bits = fmt
+    dtype = _DTYPES.get((format_tag, bits))
+    if (dtype is None) or (block_align != channels * dtype.itemsize):
+        raise audio_exceptions.UnsupportedWavFormat(path)
+
+    # Data size may be wrong in files that were not closed properly
+    data_size = min(data_size, os.path.getsize(path) - data_offset)
+    frames = data_size // block_align
+    if frames == 0:
+        raise audio_exceptions.UnsupportedWavFormat(path)
+    return dtype, channels, fs, data_offset, frames
+
+
+def _parse_chunks(fh):
+    """ Read the RIFF chunk list. Returns the 'fmt ' fields
+        (format tag, channels, fs, block align, bits), and the
+        offset and size of the 'data' chunk.
+    """
+    header = fh.read(12)
+    if len(header) < 12:
+        raise audio_exceptions.UnsupportedWavFormat(fh.name)
+    riff, _, wave = struct.unpack('<4sI4s', header)
+    if (riff != b'RIFF') or (wave != b'WAVE'):
+        raise audio_exceptions.UnsupportedWavFormat(fh.name)
+
+    fmt = None
+    while True:
+        header = fh.read(8)
+        if len(header) < 8:
+            # No data chunk
+            raise audio_exceptions.UnsupportedWavFormat(fh.name)
+        chunk_id, size = struct.unpack('<4sI', header)
+
+        if chunk_id == b'fmt ':
+            fmt = _parse_fmt(fh.read(size), fh.name)
+            fh.seek(size % 2, os.SEEK_CUR)
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise audio_exceptions.UnsupportedWavFormat(fh.name)
+            return fmt, fh.tell(), size
+        else:
+            # Chunks are padded to an even length
+            fh.seek(size + size % 2, os.SEEK_CUR)
+
+
+def _parse_fmt(chunk, path):
+    """ Unpack a 'fmt ' chunk, resolving WAVE_FORMAT_EXTENSIBLE
+        to the sub-format tag.
+    """
+    if len(chunk) < 16:
+        raise audio_exceptions.UnsupportedWavFormat(path)
+    format_tag, channels, fs, _, block_align, bits = \
+        struct.unpack('<HHIIHH', chunk[:16])
+
+    if format_tag == WAVE_FORMAT_EXTENSIBLE:
+        if len(chunk) < 26:
+            raise audio_exceptions.UnsupportedWavFormat(path)
+        # First two bytes of the sub-format GUID hold the tag
+        format_tag = struct.unpack('<H', chunk[24:26])[0]
+
+    return format_tag, channels, fs, block_align, bits
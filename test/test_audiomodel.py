@@ -18,9 +18,10 @@ import numpy as np
 import pandas as pd
 
 # Import audio packages
-#import soundfile as sf
+import soundfile as sf
 
 # Import system packages
+import tempfile
 from pathlib import Path
 
 # Import custom modules
@@ -91,6 +92,13 @@ class TestAudioModel(TestCase):
         # Number of channels
         self.assertEqual(self.a_eightchan.num_channels, 8)
 
+    def test_time_base_on_request(self):
+        self.a_stereo = audiomodel.Audio(self.stereo_array, sampling_rate=48000)
+        # Not stored on the object
+        self.assertNotIn('t', vars(self.a_stereo))
+        self.assertEqual(len(self.a_stereo.t), len(self.stereo_array))
+        self.assertEqual(self.a_stereo.t[48], 0.001)
+
     def test_missing_sampling_rate(self):
         with self.assertRaises(audio_exceptions.MissingSamplingRate):
             self.a_mono = audiomodel.Audio(self.mono_array)
@@ -132,6 +140,25 @@ class TestAudioModel(TestCase):
         with self.assertRaises(audio_exceptions.Clipping):
             self.audio.play(level=3000, device_id=2, routing=[1])
 
+    def test_clipping_from_known_peaks(self):
+        self.audio = audiomodel.Audio(self.mono_array, sampling_rate=48000,
+            peaks=[0.5])
+        with mock.patch('models.audiomodel.levels.peak') as fake_peak:
+            with self.assertRaises(audio_exceptions.Clipping):
+                self.audio.prepare(level=6.1, device_id=2, routing=[1])
+            self.audio.prepare(level=6, device_id=2, routing=[1])
+            # No scan of the scaled buffer
+            fake_peak.assert_not_called()
+
+    def test_stream_clipping_from_known_peaks(self):
+        fake_engine = mock.MagicMock()
+        self.audio = audiomodel.Audio(self.mono_array, sampling_rate=48000,
+            peaks=[0.5])
+        with self.assertRaises(audio_exceptions.Clipping):
+            self.audio.stream(level=10, device_id=2, routing=[1],
+                engine=fake_engine)
+        fake_engine.play_stream.assert_not_called()
+
     def test_play_truncate_channels_to_match_device_outputs(self):
         with mock.patch('models.audiomodel.sd.play') as fake_play:
             self.audio = audiomodel.Audio(self.eightchan_array, sampling_rate=48000)
@@ -144,6 +171,61 @@ class TestAudioModel(TestCase):
             self.audio.play(level=-30, device_id=2, routing=[1,2])
             self.assertEqual(self.audio.temp.shape, (48000,2))
 
+    def test_normalize_multichannel(self):
+        rng = np.random.default_rng(0)
+        signal = rng.normal(0.1, 0.3, size=(4800, 8))
+        signal[:, 3] = 0.2 # DC only: silent after offset removal
+        self.audio = audiomodel.Audio(signal, sampling_rate=48000)
+        self.audio.temp = self.audio.signal.astype(np.float32)
+        self.audio.level = None
+        self.audio._set_level()
+
+        expected = signal - signal.mean(axis=0)
+        peaks = np.abs(expected).max(axis=0)
+        expected = np.divide(expected, peaks * 8, 
+            out=np.zeros_like(expected), where=peaks > 1e-6)
+        np.testing.assert_allclose(self.audio.temp, expected, atol=1e-6)
+
+        # Offsets and gains are reused
+        normalization = self.audio._normalization
+        self.audio.temp = self.audio.signal.astype(np.float32)
+        self.audio._set_level()
+        self.assertIs(self.audio._normalization, normalization)
+
+    def test_stream_unmapped_file(self):
+        """ Files that cannot be memory-mapped are streamed from 
+            disk without decoding the whole file.
+        """
+        fake_engine = mock.MagicMock()
+        with tempfile.TemporaryDirectory() as tempdir:
+            path = Path(tempdir) / 'pcm24.wav'
+            sf.write(path, np.zeros((4800, 2)), 48000, subtype='PCM_24')
+            with mock.patch('models.audiomodel.sf.read') as fake_read:
+                self.audio = audiomodel.Audio(path)
+                self.assertEqual(self.audio.num_channels, 2)
+                self.assertAlmostEqual(self.audio.dur, 0.1)
+                self.audio.stream(level=-20, device_id=2, routing=[1,2],
+                    engine=fake_engine)
+                fake_read.assert_not_called()
+
+            signal = fake_engine.play_stream.call_args.args[0]
+            self.assertIsInstance(signal, sf.SoundFile)
+            signal.close()
+
+    def test_stream_without_copy(self):
+        fake_engine = mock.MagicMock()
+        self.audio = audiomodel.Audio(self.eightchan_array, sampling_rate=48000)
+        self.audio.stream(level=-20, device_id=2, routing=[1,2,3,4,5,6,7,8],
+            engine=fake_engine)
+
+        signal, gain, routing, fs = fake_engine.play_stream.call_args.args
+        # Channels dropped by view, not copied
+        self.assertTrue(np.shares_memory(signal, self.eightchan_array))
+        self.assertEqual(signal.shape, (48000,2))
+        self.assertAlmostEqual(gain, 0.1)
+        self.assertEqual(routing, [1,2])
+        self.assertIsNone(self.audio.temp)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -58,6 +58,7 @@ class TestCSVModel(TestCase):
         del self.root
         del self.fake_sessionpars
         
+        self.c.close()
         if self.c.file.exists():
             self.c.file.unlink()
         del self.c
@@ -231,19 +232,13 @@ class TestCSVModel(TestCase):
                 self.c, '_check_data_directory'
             ) as mock_check_data_dir:
                 self.c.save_record(test_data1)
-                mock_check_data_dir.assert_called_once()
-
-            with mock.patch.object(
-                self.c, '_check_data_directory'
-            ) as mock_check_data_dir:
                 self.c.save_record(test_data2)
+                # File is opened once per session
                 mock_check_data_dir.assert_called_once()
 
-            # Ensure _check_write_access is called twice (once for each
-            # save_record call)
-            mock_check_write_access.assert_has_calls(
-                [mock.call()] * 2
-            )
+            # Ensure _check_write_access is called once (when the 
+            # file is opened)
+            mock_check_write_access.assert_called_once()
 
             # Check if the file was created and contains the correct data
             self.assertTrue(self.c.file.exists())
@@ -262,8 +257,63 @@ class TestCSVModel(TestCase):
             # written
             self.assertEqual(actual_rows, [test_data1, test_data2])
 
+            # Records above were read while the file was still open
+            self.c.close()
+
             # Check if the content is well-formed CSV
             try:
                 csv.reader(open(self.c.file, 'r').read().splitlines(), delimiter=',')
             except csv.Error as e:
-                self.fail(f"The actual content is not well-formed CSV: {e}")
\ No newline at end of file
+                self.fail(f"The actual content is not well-formed CSV: {e}")
+
+
+    @mock.patch('models.csvmodel.os.fsync')
+    def test_save_record_fsync_batching(self, mock_fsync):
+        self.c.fsync_every = 3
+        with mock.patch.object(self.c, '_check_write_access'):
+            for ii in range(7):
+                self.c.save_record({'trial': ii})
+            # Synced after records 3 and 6
+            self.assertEqual(mock_fsync.call_count, 2)
+            self.c.close()
+            self.assertEqual(mock_fsync.call_count, 3)
+
+
+    def test_save_record_async_order(self):
+        with mock.patch.object(self.c, '_check_write_access'):
+            for ii in range(50):
+                self.c.save_record_async({'trial': ii})
+            # close() waits for queued records
+            self.c.close()
+
+        with open(self.c.file, 'r') as file:
+            trials = [int(row['trial']) for row in csv.DictReader(file)]
+        self.assertEqual(trials, list(range(50)))
+        self.assertEqual(self.c.get_errors(), [])
+
+
+    def test_save_record_async_errors(self):
+        with mock.patch.object(self.c, '_check_write_access',
+                side_effect=PermissionError("Mocked denied")):
+            self.c.save_record_async({'trial': 1})
+            self.c.close()
+
+        errors = self.c.get_errors()
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], PermissionError)
+
+
+    def test_save_record_async_bad_record(self):
+        with mock.patch.object(self.c, '_check_write_access'):
+            self.c.save_record_async({'trial': 1})
+            # New key: DictWriter raises ValueError
+            self.c.save_record_async({'trial': 2, 'extra': 0})
+            self.c.save_record_async({'trial': 3})
+            self.c.close()
+
+        errors = self.c.get_errors()
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], ValueError)
+        with open(self.c.file, 'r') as file:
+            trials = [int(row['trial']) for row in csv.DictReader(file)]
+        self.assertEqual(trials, [1, 3])
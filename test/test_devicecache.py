@@ -0,0 +1,64 @@
+""" Tests for devicecache """
+
+###########
+# Imports #
+###########
+# Import testing packages
+import unittest
+from unittest import mock
+
+# Import custom modules
+from models import devicecache
+from exceptions import audio_exceptions
+
+
+#########
+# Begin #
+#########
+class TestDeviceCache(unittest.TestCase):
+    """ Unit tests for devicecache module.
+    """
+
+    def setUp(self):
+        self.devices = [
+            {'name': 'Microphone', 'max_output_channels': 0},
+            {'name': 'Speakers', 'max_output_channels': 2},
+        ]
+        patcher = mock.patch('models.devicecache.sd.query_devices',
+            return_value=self.devices)
+        self.fake_query = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # Start each test with an empty cache
+        devicecache._devices = None
+        self.addCleanup(setattr, devicecache, '_devices', None)
+
+
+    def test_enumerates_once(self):
+        devicecache.query_devices()
+        devicecache.get_device(1)
+        devicecache.output_devices()
+        self.fake_query.assert_called_once()
+
+
+    def test_refresh(self):
+        devicecache.query_devices()
+        devicecache.refresh()
+        self.assertEqual(self.fake_query.call_count, 2)
+
+
+    def test_get_device(self):
+        self.assertEqual(devicecache.get_device(1)['name'], 'Speakers')
+
+
+    def test_get_invalid_device(self):
+        with self.assertRaises(audio_exceptions.InvalidAudioDevice):
+            devicecache.get_device(999)
+
+
+    def test_output_devices(self):
+        self.assertEqual(devicecache.output_devices(), [(1, 'Speakers', 2)])
+
+
+if __name__ == '__main__':
+    unittest.main()
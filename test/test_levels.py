@@ -0,0 +1,94 @@
+""" Tests for levels """
+
+###########
+# Imports #
+###########
+# Import testing packages
+import unittest
+
+# Import data science packages
+import numpy as np
+
+# Import custom modules
+from functions import levels
+
+
+#########
+# Begin #
+#########
+class TestLevels(unittest.TestCase):
+    """ Unit tests for level functions.
+    """
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.sig = rng.normal(0, 0.1, size=(4800, 6)).astype(np.float32)
+        # Channel levels differ by 6 dB steps
+        self.sig *= levels.db2mag(np.arange(6) * -6).astype(np.float32)
+
+
+    def test_db2mag_mag2db(self):
+        self.assertEqual(levels.db2mag(-20), 0.1)
+        np.testing.assert_allclose(levels.db2mag([0, 20, -40]), [1, 10, 0.01])
+        np.testing.assert_allclose(levels.mag2db(levels.db2mag([-3, 6])),
+            [-3, 6])
+
+
+    def test_rms_and_peak(self):
+        sig = np.array([[1, -3], [-1, 3]], dtype=np.float32)
+        self.assertAlmostEqual(levels.rms(sig), np.sqrt(5))
+        np.testing.assert_allclose(levels.rms(sig, axis=0), [1, 3])
+        self.assertEqual(levels.peak(sig), 3)
+        np.testing.assert_array_equal(levels.peak(sig, axis=0), [1, 3])
+        # Integer and float32 sums are accumulated in float64
+        self.assertAlmostEqual(levels.rms(np.full(1000, 20000, np.int16)),
+            20000)
+        self.assertAlmostEqual(levels.rms(np.full(10**7, 0.1, np.float32)),
+            0.1, places=6)
+        # Most negative integer does not overflow
+        self.assertEqual(levels.peak(np.array([-32768, 5], dtype=np.int16)),
+            32768)
+
+
+    def test_set_rms_keeps_channel_differences(self):
+        before = levels.mag2db(levels.rms(self.sig, axis=0))
+        result = levels.set_rms(self.sig, -30)
+        after = levels.mag2db(levels.rms(result, axis=0))
+
+        self.assertEqual(result.dtype, np.float32)
+        self.assertAlmostEqual(np.mean(after), -30, places=4)
+        np.testing.assert_allclose(after - before, after[0] - before[0], 
+            atol=1e-4)
+
+
+    def test_set_rms_equalize_in_place(self):
+        result = levels.set_rms(self.sig, -20, equalize=True, inplace=True)
+        self.assertIs(result, self.sig)
+        np.testing.assert_allclose(
+            levels.mag2db(levels.rms(self.sig, axis=0)), -20, atol=1e-4)
+
+
+    def test_set_rms_silent_channel(self):
+        self.sig[:, 2] = 0
+        result = levels.set_rms(self.sig, -20, equalize=True)
+        self.assertFalse(result[:, 2].any())
+        self.assertFalse(np.isnan(result).any())
+
+
+    def test_scale_integer_signal(self):
+        sig = np.full((100, 2), 16384, dtype=np.int16)
+        result = levels.set_rms(sig, -20)
+        self.assertEqual(result.dtype, np.float32)
+        self.assertAlmostEqual(levels.mag2db(levels.rms(result)), -20, 
+            places=4)
+        with self.assertRaises(TypeError):
+            levels.scale(sig, 0.5, inplace=True)
+
+
+    def test_set_rms_sequence(self):
+        result = levels.set_rms([0.5, -0.5], -20)
+        np.testing.assert_allclose(result, [0.1, -0.1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,252 @@
+""" Tests for playbackengine """
+
+###########
+# Imports #
+###########
+# Import testing packages
+import unittest
+from unittest import mock
+
+# Import data science packages
+import numpy as np
+
+# Import system packages
+import os
+import tempfile
+
+# Import audio packages
+import soundfile as sf
+
+# Import custom modules
+from models import playbackengine
+from exceptions import audio_exceptions
+
+
+#########
+# Begin #
+#########
+class TestPlaybackEngine(unittest.TestCase):
+    """ Unit tests for PlaybackEngine class. The output stream
+        is mocked; the callback is called directly.
+    """
+
+    def setUp(self):
+        self.device = {'name': 'Fake Device', 'max_output_channels': 4}
+        patcher_query = mock.patch(
+            'models.playbackengine.devicecache.get_device',
+            return_value=self.device)
+        patcher_stream = mock.patch('models.playbackengine.sd.OutputStream')
+        self.fake_query = patcher_query.start()
+        self.fake_stream = patcher_stream.start()
+        self.addCleanup(mock.patch.stopall)
+
+        self.engine = playbackengine.PlaybackEngine(
+            device_id=1, samplerate=48000, blocksize=4)
+
+
+    def _run_block(self, frames=4):
+        outdata = np.ones((frames, 4), dtype=np.float32)
+        self.engine._callback(outdata, frames, None, None)
+        return outdata
+
+
+    def test_stream_opened_once(self):
+        buffer = np.ones((10, 2), dtype=np.float32)
+        self.engine.play(buffer, [1, 2], 48000)
+        self.engine.play(buffer, [1, 2], 48000)
+        self.fake_stream.assert_called_once()
+        self.assertEqual(self.fake_stream.call_args.kwargs['channels'], 4)
+
+
+    def test_reopen_on_samplerate_change(self):
+        buffer = np.ones((10, 2), dtype=np.float32)
+        self.engine.play(buffer, [1, 2], 44100)
+        self.assertEqual(self.fake_stream.call_count, 2)
+        self.assertEqual(self.engine.samplerate, 44100)
+
+
+    def test_silence_when_idle(self):
+        outdata = self._run_block()
+        self.assertFalse(outdata.any())
+
+
+    def test_routing_and_position(self):
+        buffer = np.arange(6, dtype=np.float32).reshape(6, 1)
+        self.engine.play(buffer, [3], 48000)
+
+        outdata = self._run_block()
+        np.testing.assert_array_equal(outdata[:, 2], [0, 1, 2, 3])
+        self.assertFalse(outdata[:, [0, 1, 3]].any())
+
+        # Final partial block is zero padded and releases the buffer
+        outdata = self._run_block()
+        np.testing.assert_array_equal(outdata[:, 2], [4, 5, 0, 0])
+        self.assertFalse(self.engine.is_playing)
+
+
+    def test_mono_buffer(self):
+        self.engine.play(np.ones(4, dtype=np.float32), [2], 48000)
+        outdata = self._run_block()
+        np.testing.assert_array_equal(outdata[:, 1], [1, 1, 1, 1])
+
+
+    def test_stop(self):
+        self.engine.play(np.ones((10, 1), dtype=np.float32), [1], 48000)
+        self.engine.stop()
+        self.assertFalse(self._run_block().any())
+
+
+    def test_pair_switch_keeps_position(self):
+        a = np.full((12, 1), 1, dtype=np.float32)
+        b = np.full((12, 1), 2, dtype=np.float32)
+        self.engine.load_pair([a, b], [1], 48000)
+        self.engine.select(0)
+        np.testing.assert_array_equal(self._run_block()[:, 0], [1] * 4)
+
+        # Hard switch at the next block, same position
+        self.engine.select(1)
+        np.testing.assert_array_equal(self._run_block()[:, 0], [2] * 4)
+        self.assertEqual(self.engine._pair.position, 8)
+
+        # Reloading the same buffers keeps playing
+        self.engine.load_pair([a, b], [1], 48000)
+        self.assertTrue(self.engine.is_playing)
+
+
+    def test_pair_crossfade(self):
+        a = np.full((12, 1), 1, dtype=np.float32)
+        b = np.full((12, 1), 2, dtype=np.float32)
+        self.engine.load_pair([a, b], [1], 48000)
+        self.engine.select(0)
+        self._run_block()
+        self.engine.select(1, crossfade=True)
+
+        # Fades from 1 to 2 over one block, then plays B
+        outdata = self._run_block()
+        np.testing.assert_allclose(outdata[:, 0], [1, 4/3, 5/3, 2])
+        np.testing.assert_array_equal(self._run_block()[:, 0], [2] * 4)
+
+
+    def test_pair_restarts_after_end(self):
+        a = np.ones((4, 1), dtype=np.float32)
+        self.engine.load_pair([a, a * 2], [1], 48000)
+        self.engine.select(0)
+        self._run_block()
+        self.assertFalse(self.engine.is_playing)
+
+        self.engine.select(1)
+        self.assertEqual(self.engine._pair.position, 0)
+        np.testing.assert_array_equal(self._run_block()[:, 0], [2] * 4)
+
+
+    def test_stream_scales_and_routes(self):
+        signal = np.arange(10, dtype=np.int16).reshape(10, 1) * 1024
+        self.engine.play_stream(signal, 2, [2], 48000, num_blocks=2)
+
+        # First blocks are ready before playback starts
+        outdata = self._run_block()
+        np.testing.assert_allclose(outdata[:, 1], 
+            np.arange(4) * 1024 * 2 / 32768)
+        self.assertFalse(outdata[:, [0, 2, 3]].any())
+
+        # Feeder thread refills the ring
+        source = self.engine._source
+        source.thread.join(timeout=5)
+        self._run_block()
+        outdata = self._run_block()
+        np.testing.assert_allclose(outdata[:, 1], 
+            [8 * 2048 / 32768, 9 * 2048 / 32768, 0, 0])
+        self._run_block()
+        self.assertFalse(self.engine.is_playing)
+
+
+    def test_stream_from_file(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, 'stereo.wav')
+            signal = np.tile([[0.25, 0.5]], (10, 1))
+            sf.write(path, signal, 48000, subtype='PCM_24')
+            sound_file = sf.SoundFile(path)
+
+            # Second file channel is not routed
+            self.engine.play_stream(sound_file, 2, [3], 48000, num_blocks=2)
+            np.testing.assert_allclose(self._run_block()[:, 2], [0.5] * 4)
+            source = self.engine._source
+            source.thread.join(timeout=5)
+            self._run_block()
+            outdata = self._run_block()
+            np.testing.assert_allclose(outdata[:, 2], [0.5, 0.5, 0, 0])
+            self.assertTrue(sound_file.closed)
+
+
+    def test_stream_resampled(self):
+        """ Signals at another rate are resampled block by block 
+            without reopening the stream, as resample_poly would.
+        """
+        rng = np.random.default_rng(0)
+        signal = rng.uniform(-0.4, 0.4, (100, 1)).astype(np.float32)
+        self.engine.play_stream(signal, 1, [1], 44100, num_blocks=64)
+        source = self.engine._source
+        source.thread.join(timeout=5)
+        played = []
+        while self.engine.is_playing:
+            played.append(self._run_block()[:, 0])
+        self.fake_stream.assert_called_once()
+
+        expected = playbackengine.sps.resample_poly(signal[:, 0], 160, 147)
+        played = np.concatenate(played)
+        np.testing.assert_allclose(played[:len(expected)], expected, 
+            atol=1e-6)
+        self.assertFalse(played[len(expected):].any())
+
+
+    def test_resampler_chunks(self):
+        signal = np.sin(np.arange(1000) / 10).reshape(-1, 1)
+        expected = playbackengine.sps.resample_poly(signal, 160, 147)
+        resampler = playbackengine._Resampler(44100, 48000, 1)
+        chunks = [resampler.process(signal[start:start + 37])
+            for start in range(0, len(signal), 37)]
+        resampled = np.concatenate(chunks + [resampler.flush()])
+        self.assertEqual(resampled.shape, expected.shape)
+        np.testing.assert_allclose(resampled, expected, atol=1e-5)
+
+
+    def test_stream_clipping_at_start(self):
+        signal = np.full((100, 1), 0.6, dtype=np.float32)
+        with self.assertRaises(audio_exceptions.Clipping):
+            self.engine.play_stream(signal, 2, [1], 48000)
+        self.assertFalse(self.engine.is_playing)
+
+
+    def test_stream_clipping_reported(self):
+        signal = np.full((40, 1), 0.5, dtype=np.float32)
+        signal[30:] = 0.9
+        self.engine.play_stream(signal, 2 * 0.99, [1], 48000, num_blocks=2)
+        source = self.engine._source
+        while source.thread.is_alive() or source.read_count < source.written:
+            self._run_block()
+        self._run_block()
+
+        self.assertFalse(self.engine.is_playing)
+        errors = self.engine.get_errors()
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], audio_exceptions.Clipping)
+
+
+    def test_stream_replaced(self):
+        signal = np.zeros((1000, 1), dtype=np.float32)
+        self.engine.play_stream(signal, 1, [1], 48000, num_blocks=2)
+        source = self.engine._source
+        self.engine.play(np.ones((4, 1), dtype=np.float32), [1], 48000)
+
+        # Feeder thread exits
+        source.thread.join(timeout=5)
+        self.assertFalse(source.thread.is_alive())
+
+
+    def test_invalid_routing(self):
+        with self.assertRaises(audio_exceptions.InvalidRouting):
+            self.engine.play(np.ones((10, 1), dtype=np.float32), [5], 48000)
+
+
+if __name__ == '__main__':
+    unittest.main()
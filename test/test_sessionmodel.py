@@ -0,0 +1,79 @@
+""" Tests for sessionmodel """
+
+###########
+# Imports #
+###########
+# Import testing packages
+import unittest
+from unittest import mock
+
+# Import system packages
+import copy
+import json
+import tempfile
+from pathlib import Path
+
+# Import custom modules
+from models import sessionmodel
+
+
+#########
+# Begin #
+#########
+class TestSessionParsModel(unittest.TestCase):
+    """ Unit tests for SessionParsModel class. The config file
+        is written to a temporary "home" directory.
+    """
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        patcher = mock.patch('models.sessionmodel.Path.home',
+            return_value=Path(self.tempdir.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # Fields are a class attribute: restore after each test
+        fields = copy.deepcopy(sessionmodel.SessionParsModel.fields)
+        self.addCleanup(setattr, sessionmodel.SessionParsModel,
+            'fields', fields)
+
+        self.model = sessionmodel.SessionParsModel({'name': 'Test App'})
+
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+
+    def test_update_writes_once(self):
+        with mock.patch('models.sessionmodel.json.dump') as fake_dump:
+            self.model.update({'subject': '123', 'repetitions': 3})
+            self.model.save()
+            fake_dump.assert_called_once()
+        self.assertEqual(self.model.fields['subject']['value'], '123')
+
+
+    def test_save_skipped_when_unchanged(self):
+        self.model.save()
+        with mock.patch('models.sessionmodel.json.dump') as fake_dump:
+            self.model.update({'subject': self.model.fields['subject']['value']})
+            self.model.save()
+            fake_dump.assert_not_called()
+
+
+    def test_save_replaces_file(self):
+        self.model.update({'subject': '123'})
+        self.model.save()
+        with open(self.model.filepath, 'r') as fh:
+            self.assertEqual(json.load(fh)['subject']['value'], '123')
+        # No temporary file left behind
+        self.assertEqual(list(self.model.filepath.parent.iterdir()),
+            [self.model.filepath])
+
+
+    def test_set_wrong_type(self):
+        with self.assertRaises(ValueError):
+            self.model.set('repetitions', 'three')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,228 @@
+""" Tests for stimuluscache """
+
+###########
+# Imports #
+###########
+# Import testing packages
+import unittest
+from unittest import mock
+
+# Import data science packages
+import numpy as np
+
+# Import system packages
+import os
+import tempfile
+
+# Import audio packages
+import soundfile as sf
+
+# Import custom modules
+from models.stimuluscache import StimulusCache
+from models import stimuluscache
+from models import wavfile
+
+
+#########
+# Begin #
+#########
+class TestStimulusCache(unittest.TestCase):
+    """ Unit tests for StimulusCache class.
+    """
+
+    def setUp(self):
+        """ Write three short mono .wav files to a temp directory.
+            Each holds 1000 float64 samples (8000 bytes).
+        """
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.files = []
+        for ii in range(3):
+            path = os.path.join(self.tempdir.name, f"stim_{ii}.wav")
+            sf.write(path, np.zeros(1000), 48000, subtype='DOUBLE')
+            self.files.append(path)
+
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+
+    def test_get_decodes_once(self):
+        cache = StimulusCache(max_bytes=1024**2)
+        with mock.patch('models.stimuluscache.wavfile.read',
+                        wraps=wavfile.read) as fake_read:
+            cache.get(self.files[0])
+            cache.get(self.files[0])
+            fake_read.assert_called_once()
+
+
+    def test_cached_arrays_are_read_only(self):
+        cache = StimulusCache(max_bytes=1024**2)
+        signal, fs = cache.get(self.files[0])
+        self.assertEqual(fs, 48000)
+        with self.assertRaises(ValueError):
+            signal[0] = 1
+
+
+    def test_lru_eviction(self):
+        # Room for two files only
+        cache = StimulusCache(max_bytes=16000)
+        cache.get(self.files[0])
+        cache.get(self.files[1])
+        # Touch file 0 so file 1 becomes least recently used
+        cache.get(self.files[0])
+        cache.get(self.files[2])
+
+        self.assertIn(self.files[0], cache)
+        self.assertNotIn(self.files[1], cache)
+        self.assertIn(self.files[2], cache)
+        self.assertEqual(cache.nbytes, 16000)
+
+
+    def test_preload_stops_at_budget(self):
+        cache = StimulusCache(max_bytes=16000)
+        cache.preload(self.files + [self.files[0]])
+        self.assertEqual(len(cache), 2)
+        self.assertNotIn(self.files[2], cache)
+
+
+    def test_preload_native_sizes(self):
+        """ 16-bit files are budgeted at 2 bytes per sample and 
+            loaded into memory, not mapped.
+        """
+        paths = []
+        for ii in range(4):
+            path = os.path.join(self.tempdir.name, f"pcm_{ii}.wav")
+            sf.write(path, np.zeros(100000), 48000, subtype='PCM_16')
+            paths.append(path)
+        cache = StimulusCache(max_bytes=400000)
+        cache.preload(paths)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.nbytes, 400000)
+        signal, fs = cache.get(paths[0])
+        self.assertNotIsInstance(signal, np.memmap)
+
+
+    def test_preload_skips_missing_files(self):
+        cache = StimulusCache(max_bytes=1024**2)
+        cache.preload(['missing.wav'] + self.files)
+        self.assertEqual(len(cache), 3)
+
+
+    def test_get_missing_file(self):
+        cache = StimulusCache(max_bytes=1024**2)
+        with self.assertRaises(FileNotFoundError):
+            cache.get('missing.wav')
+
+
+    def test_prefetch(self):
+        cache = StimulusCache(max_bytes=1024**2)
+        with mock.patch('models.stimuluscache.wavfile.read',
+                        wraps=wavfile.read) as fake_read:
+            cache.prefetch(self.files[:2])
+            # Waits for the background decode instead of reading again
+            signal, fs = cache.get(self.files[1])
+            cache.get(self.files[0])
+            self.assertEqual(fake_read.call_count, 2)
+        self.assertEqual(signal.shape, (1000,))
+        self.assertIn(self.files[0], cache)
+        cache.shutdown()
+
+
+    def test_prefetch_missing_file(self):
+        cache = StimulusCache(max_bytes=1024**2)
+        cache.prefetch(['missing.wav'])
+        with self.assertRaises(FileNotFoundError):
+            cache.get('missing.wav')
+        cache.shutdown()
+
+
+    def test_get_resampled(self):
+        cache = StimulusCache(max_bytes=1024**2)
+        with mock.patch('models.stimuluscache.sps.resample_poly',
+                        wraps=stimuluscache.sps.resample_poly) as fake_resample:
+            signal, fs = cache.get(self.files[0], samplerate=44100)
+            cache.get(self.files[0], samplerate=44100)
+            fake_resample.assert_called_once()
+        self.assertEqual(fs, 44100)
+        self.assertEqual(signal.shape, (919,))
+        self.assertEqual(signal.dtype, np.float32)
+        self.assertFalse(signal.flags.writeable)
+
+        # Only the resampled signal is kept
+        self.assertNotIn(self.files[0], cache)
+        self.assertEqual(cache.nbytes, signal.nbytes)
+        self.assertEqual(cache.get(self.files[0], samplerate=48000)[1], 48000)
+
+
+    def test_get_resampled_leaves_original_unused(self):
+        # Room for two files only
+        cache = StimulusCache(max_bytes=16000)
+        cache.get(self.files[0])
+        cache.get(self.files[1])
+        # Resampling file 0 does not mark its original as used
+        cache.get(self.files[0], samplerate=44100)
+        self.assertNotIn(self.files[0], cache)
+        self.assertIn(self.files[1], cache)
+
+
+    def test_preload_resampled(self):
+        cache = StimulusCache(max_bytes=1024**2)
+        cache.preload(self.files, samplerate=44100)
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.nbytes, 3 * 919 * 4)
+        with mock.patch('models.stimuluscache.sps.resample_poly') \
+                as fake_resample:
+            signal, fs = cache.get(self.files[0], samplerate=44100)
+            fake_resample.assert_not_called()
+        self.assertEqual(fs, 44100)
+
+
+    def test_prefetch_resampled(self):
+        cache = StimulusCache(max_bytes=1024**2)
+        cache.prefetch(self.files[:1], samplerate=44100)
+        # Wait for the background thread
+        cache.submit(lambda: None).result()
+        with mock.patch('models.stimuluscache.sps.resample_poly') \
+                as fake_resample:
+            signal, fs = cache.get(self.files[0], samplerate=44100)
+            fake_resample.assert_not_called()
+        self.assertEqual(fs, 44100)
+        cache.shutdown()
+
+
+    def test_store_twice_counts_once(self):
+        cache = StimulusCache(max_bytes=1024**2)
+        signal, fs = cache.get(self.files[0])
+        with cache._lock:
+            cache._store(self.files[0], signal, fs)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.nbytes, signal.nbytes)
+
+
+    def test_get_peaks(self):
+        path = os.path.join(self.tempdir.name, 'stereo.wav')
+        sf.write(path, np.tile([[0.25, -0.5]], (100, 1)), 48000,
+            subtype='PCM_16')
+        cache = StimulusCache(max_bytes=1024**2)
+        np.testing.assert_allclose(cache.get_peaks(path), [0.25, 0.5])
+
+        # Known peaks are used without scanning the signal
+        cache.set_peaks(self.files[0], [0.1])
+        with mock.patch('models.stimuluscache.levels.peak') as fake_peak:
+            np.testing.assert_array_equal(cache.get_peaks(self.files[0]), 
+                [0.1])
+            fake_peak.assert_not_called()
+
+
+    def test_resampled_peaks_kept_apart(self):
+        # Resampling a square wave overshoots its native peak
+        path = os.path.join(self.tempdir.name, 'square.wav')
+        square = np.tile([0.5] * 24 + [-0.5] * 24, 20)
+        sf.write(path, square, 48000, subtype='PCM_16')
+        cache = StimulusCache(max_bytes=1024**2)
+        self.assertGreater(cache.get_peaks(path, samplerate=44100)[0], 0.5)
+        np.testing.assert_array_equal(cache.get_peaks(path), [0.5])
+
+
+if __name__ == '__main__':
+    unittest.main()
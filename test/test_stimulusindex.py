@@ -0,0 +1,111 @@
+""" Tests for stimulusindex """
+
+###########
+# Imports #
+###########
+# Import testing packages
+import unittest
+from unittest import mock
+
+# Import data science packages
+import numpy as np
+
+# Import system packages
+import os
+import tempfile
+
+# Import audio packages
+import soundfile as sf
+
+# Import custom modules
+from models.stimulusindex import StimulusIndex
+
+
+#########
+# Begin #
+#########
+class TestStimulusIndex(unittest.TestCase):
+    """ Unit tests for StimulusIndex class.
+    """
+
+    def setUp(self):
+        """ Write two short .wav files to a temp directory.
+        """
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tempdir.name, 'index.db')
+
+        self.mono = os.path.join(self.tempdir.name, 'mono.wav')
+        sf.write(self.mono, np.full(1000, 0.5), 48000, subtype='FLOAT')
+        self.stereo = os.path.join(self.tempdir.name, 'stereo.wav')
+        sf.write(self.stereo, np.tile([[0.25, -0.75]], (500, 1)), 44100,
+            subtype='FLOAT')
+
+        self.index = StimulusIndex(self.db_path, blocksize=256)
+
+
+    def tearDown(self):
+        self.index.close()
+        self.tempdir.cleanup()
+
+
+    def test_refresh_scans_files(self):
+        self.assertEqual(self.index.refresh([self.mono, self.stereo]), 2)
+
+        entry = self.index.get(self.mono)
+        self.assertEqual((entry.frames, entry.channels, entry.samplerate),
+            (1000, 1, 48000))
+        self.assertAlmostEqual(entry.rms, 0.5)
+        self.assertAlmostEqual(entry.peak, 0.5)
+
+        entry = self.index.get(self.stereo)
+        self.assertEqual(entry.channels, 2)
+        self.assertAlmostEqual(entry.rms, np.sqrt((0.25**2 + 0.75**2) / 2))
+        self.assertAlmostEqual(entry.peak, 0.75)
+        np.testing.assert_allclose(entry.channel_peaks, [0.25, 0.75])
+
+
+    def test_loudness(self):
+        # Full-scale 997 Hz sine is -3.01 LKFS
+        fs = 48000
+        tone = np.sin(2 * np.pi * 997 * np.arange(fs) / fs)
+        path = os.path.join(self.tempdir.name, 'tone.wav')
+        sf.write(path, tone, fs, subtype='FLOAT')
+        silence = os.path.join(self.tempdir.name, 'silence.wav')
+        sf.write(silence, np.zeros(100), fs)
+
+        self.index.refresh([path, silence])
+        self.assertAlmostEqual(self.index.get(path).loudness, -3.01, places=1)
+        self.assertIsNone(self.index.get(silence).loudness)
+
+
+    def test_unchanged_files_not_scanned(self):
+        self.index.refresh([self.mono, self.stereo])
+
+        # Details persist between sessions
+        self.index.close()
+        self.index = StimulusIndex(self.db_path)
+        with mock.patch('models.stimulusindex.sf.info') as fake_info:
+            self.assertEqual(self.index.refresh([self.mono, self.stereo]), 0)
+            fake_info.assert_not_called()
+        self.assertIn(self.mono, self.index)
+
+
+    def test_changed_file_scanned_again(self):
+        self.index.refresh([self.mono])
+        sf.write(self.mono, np.full(2000, 0.1), 48000, subtype='FLOAT')
+
+        self.assertEqual(self.index.refresh([self.mono]), 1)
+        self.assertEqual(self.index.get(self.mono).frames, 2000)
+
+
+    def test_missing_file_removed(self):
+        self.index.refresh([self.mono])
+        os.remove(self.mono)
+
+        self.index.refresh([self.mono])
+        self.assertNotIn(self.mono, self.index)
+        self.assertIsNone(self.index.get(self.mono))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,16 +5,25 @@
 ###########
 # Import testing packages
 import unittest
-from unittest.mock import patch, mock_open
+from unittest.mock import patch, MagicMock
 
 # Import GUI packages
 import tkinter as tk
 
-# Import misc packages
-import random
+# Import data science packages
+import numpy as np
+import pandas as pd
+
+# Import system packages
+import os
+import tempfile
+
+# Import audio packages
+import soundfile as sf
 
 # Import custom modules
-from models.stimulusmodel import StimulusModel
+from models.stimulusmodel import StimulusModel, Randomizer, MATRIX_SCHEMA
+from exceptions import audio_exceptions
 
 
 #########
@@ -31,31 +40,48 @@ class TestStimulusModel(unittest.TestCase):
         # Need a root for tk variables to work
         self.root = tk.Tk()
 
-        # Mock file with data
-        self.fake_data_file = mock_open(
-            read_data=(
-                "audio_file,pres_level\r\n" # Header
-                "stim_1.wav,75\r\n" # Row 1
-                "stim_2.wav,70\r\n" # Row 2
-            )
-        )
+        # Matrix file in a temp directory
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.matrix_path = os.path.join(self.tempdir.name, 'matrix.csv')
 
         # Fake sessionpars
         self.sessionpars = {
-            'matrix_file_path': tk.StringVar(value='mock_matrix.csv'),
+            'matrix_file_path': tk.StringVar(value=self.matrix_path),
             'audio_files_dir': tk.StringVar(value='sample_audio_dir'),
             'repetitions': tk.IntVar(value=2),
-            'randomize': tk.IntVar(value=0)
+            'randomize': tk.IntVar(value=0),
+            'stim_cache_MB': tk.IntVar(value=64),
+            'stream_min_s': tk.IntVar(value=60),
+            'audio_samplerate': tk.IntVar(value=48000),
+            'switch_mode': tk.StringVar(value='restart'),
+            'no_repeats': tk.IntVar(value=0),
+            'swap_ab': tk.IntVar(value=0),
+            'block_by_category': tk.IntVar(value=0),
+            'level_mode': tk.StringVar(value='raw'),
+            'match_ref_dB': tk.DoubleVar(value=-20.0)
         }
 
+        # Matrix file with data
+        self._write_matrix(
+            # Header
+            "audio_A,audio_B,pres_level,instructions,image,category\r\n"
+            "stim_1.wav,stim_2.wav,75,Choose,img.png,1\r\n" # Row 1
+            "stim_2.wav,stim_1.wav,70,Choose,img.png,2\r\n" # Row 2
+        )
+
 
     def tearDown(self):
         """ Delete objects from setUp. Automatically runs
             after each test.
         """
         del self.root
-        del self.fake_data_file
         del self.sessionpars
+        self.tempdir.cleanup()
+
+
+    def _write_matrix(self, text):
+        with open(self.matrix_path, 'w', newline='') as fh:
+            fh.write(text)
 
 
     def test_import_matrix_file(self):
@@ -68,38 +94,36 @@ class TestStimulusModel(unittest.TestCase):
 
         # Expected output after adding audio paths
         expected_audio_names = [
-            'sample_audio_dir\\stim_1.wav', 
-            'sample_audio_dir\\stim_2.wav'
+            os.path.join('sample_audio_dir', 'stim_1.wav'), 
+            os.path.join('sample_audio_dir', 'stim_2.wav')
         ]
 
         # Expected levels
         expected_levels = [75, 70]
 
-        # Create class instance and test
-        with patch('builtins.open', self.fake_data_file):
-            # Create an instance of StimulusModel
-            stimulus_model = StimulusModel(sessionpars)
+        # Create an instance of StimulusModel
+        stimulus_model = StimulusModel(sessionpars)
 
-            # Make sure '_matrix_file' attribute was created
-            self.assertIsNotNone(stimulus_model._matrix_file)
-            # Test '_matrix_file' df shape based on mock file
-            self.assertEqual(stimulus_model._matrix_file.shape, (2,2))
-            # Test '_matrix_file' values (read original file: 1 presentation)
-            self.assertEqual(stimulus_model._matrix_file.iloc[:, 0].tolist(), expected_audio_names)
+        # Make sure '_matrix_file' attribute was created
+        self.assertIsNotNone(stimulus_model._matrix_file)
+        # Test '_matrix_file' df shape based on mock file
+        self.assertEqual(stimulus_model._matrix_file.shape, (2,6))
+        # Test '_matrix_file' values (read original file: 1 presentation)
+        self.assertEqual(stimulus_model._matrix_file.iloc[:, 0].tolist(), expected_audio_names)
 
-            # Make sure 'matrix' attribute was created
-            self.assertIsNotNone(stimulus_model.matrix)
-            # Test 'matrix' df shape based on mock file
-            self.assertEqual(stimulus_model.matrix.shape, (20,2))
-            # Test 'matrix' values (after repetitions: final output)
-            self.assertEqual(stimulus_model.matrix.iloc[:,0].tolist(), expected_audio_names*reps)
+        # Make sure 'matrix' attribute was created
+        self.assertIsNotNone(stimulus_model.matrix)
+        # Test 'matrix' df shape based on mock file
+        self.assertEqual(stimulus_model.matrix.shape, (20,6))
+        # Test 'matrix' values (after repetitions: final output)
+        self.assertEqual(stimulus_model.matrix.iloc[:,0].tolist(), expected_audio_names*reps)
 
-            # Test presentation levels
-            self.assertEqual(stimulus_model.matrix.iloc[:,1].tolist(), expected_levels*reps)
+        # Test presentation levels
+        self.assertEqual(stimulus_model.matrix.iloc[:,2].tolist(), expected_levels*reps)
 
 
     def test__randomize_called(self):
-        """ _randomized should be called when 
+        """ Trial order should be shuffled when 
             sessionpars['randomize'] == 1
         """
         # Set sessionpars
@@ -107,16 +131,17 @@ class TestStimulusModel(unittest.TestCase):
         sessionpars['randomize'].set(1)
 
         # Create class instance and test
-        with patch('builtins.open', self.fake_data_file):
-            with patch('random.shuffle') as fake_shuffle:
-                stimulus_model = StimulusModel(sessionpars)
+        with patch('models.stimulusmodel.np.random.default_rng') as fake_rng:
+            fake_rng.return_value.permutation.side_effect = lambda x: x
+            stimulus_model = StimulusModel(sessionpars, seed=40)
 
-                # Test that _randomize was called
-                fake_shuffle.assert_called_once()
+            # Test that a generator was created with the seed
+            fake_rng.assert_called_once_with(40)
+            fake_rng.return_value.permutation.assert_called_once()
 
 
     def test__randomize_not_called(self):
-        """ _randomized should NOT be called when 
+        """ Trial order should NOT be shuffled when 
             sessionpars['randomize'] == 0
         """
         # Set sessionpars
@@ -124,12 +149,12 @@ class TestStimulusModel(unittest.TestCase):
         sessionpars['randomize'].set(0)
 
         # Create class instance and test
-        with patch('builtins.open', self.fake_data_file):
-            with patch('random.shuffle') as fake_shuffle:
-                stimulus_model = StimulusModel(sessionpars)
+        with patch('models.stimulusmodel.np.random.default_rng') as fake_rng:
+            stimulus_model = StimulusModel(sessionpars)
 
-                # Test that _randomize was not called
-                fake_shuffle.assert_not_called()
+            # Test that trials were not shuffled
+            fake_rng.assert_not_called()
+            self.assertEqual(stimulus_model.order.tolist(), [0, 1, 0, 1])
 
 
     def test_zero_repetitions(self):
@@ -142,29 +167,310 @@ class TestStimulusModel(unittest.TestCase):
         sessionpars['repetitions'].set(0)
 
         # Create class instance and test
-        with patch('builtins.open', self.fake_data_file):
-            stimulus_model = StimulusModel(sessionpars)
+        stimulus_model = StimulusModel(sessionpars)
 
-            self.assertEqual(stimulus_model.matrix.shape, (2,2))
+        self.assertEqual(stimulus_model.matrix.shape, (2,6))
 
 
     def test__randomize_values(self):
-        """ Test whether the presentation levels are in 
-            a given order after randomizing with a set seed.
+        """ Test that the trial order is reproducible with a 
+            given seed, and is a permutation of the repetitions.
         """
         # Modify sessionpars to set repetitions and enable randomization
         sessionpars = self.sessionpars
         sessionpars['repetitions'].set(3)
         sessionpars['randomize'].set(1)
 
-        # Create local random number generator with fixed seed
-        rng = random.Random(40)
+        first = StimulusModel(sessionpars, seed=40)
+        second = StimulusModel(sessionpars, seed=40)
+
+        self.assertEqual(first.order.tolist(), second.order.tolist())
+        self.assertEqual(sorted(first.order.tolist()), [0, 0, 0, 1, 1, 1])
+        self.assertEqual(
+            first.matrix.iloc[:,2].tolist(),
+            [[75, 70][row] for row in first.order]
+        )
+
+
+    def test_no_repeats(self):
+        """ No matrix row is presented twice in a row.
+        """
+        sessionpars = self.sessionpars
+        sessionpars['repetitions'].set(20)
+        sessionpars['randomize'].set(1)
+        sessionpars['no_repeats'].set(1)
+
+        for seed in range(10):
+            stimulus_model = StimulusModel(sessionpars, seed=seed)
+            order = stimulus_model.order
+            self.assertEqual(len(order), 40)
+            self.assertFalse((order[1:] == order[:-1]).any())
+
+
+    def test_no_repeats_few_rows_many_reps(self):
+        """ Dense repeats are ordered directly, without slow 
+            swapping passes.
+        """
+        for rows in (np.tile(np.arange(2), 5000), 
+                np.repeat(np.arange(5), [5000, 2000, 1000, 1000, 1000])):
+            randomizer = Randomizer(seed=1, no_repeats=True)
+            with patch.object(randomizer, '_no_repeat_near') as fake_near:
+                perm = randomizer.shuffle(rows)
+                fake_near.assert_not_called()
+            self.assertEqual(sorted(perm), list(range(len(rows))))
+            seq = rows[perm]
+            self.assertFalse((seq[1:] == seq[:-1]).any())
+
+
+    def test_no_repeats_impossible(self):
+        """ Orders that cannot avoid repeats raise InvalidTrialOrder.
+        """
+        randomizer = Randomizer(seed=1, no_repeats=True)
+        with self.assertRaises(audio_exceptions.InvalidTrialOrder):
+            randomizer.shuffle(np.array([0, 0, 0, 1]))
+
+
+    def test_swap_ab_balanced(self):
+        """ Half of each row's repetitions have A and B swapped.
+        """
+        sessionpars = self.sessionpars
+        sessionpars['repetitions'].set(4)
+        sessionpars['randomize'].set(1)
+        sessionpars['swap_ab'].set(1)
+
+        stimulus_model = StimulusModel(sessionpars, seed=3)
+
+        for row in (0, 1):
+            self.assertEqual(
+                stimulus_model.swapped[stimulus_model.order == row].sum(), 2)
+
+        # Swapped trials present the original B file as A
+        k = int(np.flatnonzero(stimulus_model.swapped)[0])
+        row = stimulus_model._matrix_file.iloc[stimulus_model.order[k]]
+        self.assertEqual(stimulus_model.trials[k].audio_A, row.iloc[1])
+        self.assertEqual(stimulus_model.matrix.iloc[k, 0], row.iloc[1])
+
+
+    def test_block_by_category(self):
+        """ Trials of one category are presented together.
+        """
+        sessionpars = self.sessionpars
+        sessionpars['repetitions'].set(5)
+        sessionpars['randomize'].set(1)
+        sessionpars['block_by_category'].set(1)
+
+        stimulus_model = StimulusModel(sessionpars, seed=7)
+
+        categories = stimulus_model.matrix.iloc[:, 5].tolist()
+        self.assertEqual(len(categories), 10)
+        # Only one change of category
+        changes = sum(a != b for a, b in zip(categories, categories[1:]))
+        self.assertEqual(changes, 1)
+
+
+    def test_trial_lookup(self):
+        """ trials[k] is the record for trial k.
+        """
+        stimulus_model = StimulusModel(self.sessionpars)
+
+        self.assertEqual(stimulus_model.num_trials, 4)
+        trial = stimulus_model.trials[3]
+        self.assertEqual(trial.pres_level, 70)
+        self.assertEqual(trial.audio_A,
+            os.path.join('sample_audio_dir', 'stim_2.wav'))
+
+        # Repetitions share one immutable record
+        self.assertIs(stimulus_model.trials[1], trial)
+        with self.assertRaises(AttributeError):
+            trial.pres_level = 0
+
+
+    def test_matrix_types(self):
+        """ Columns are typed by the matrix schema; extra columns 
+            are ignored.
+        """
+        self._write_matrix(
+            "audio_A,audio_B,pres_level,instructions,image,category,notes\r\n"
+            "a.wav,b.wav,75,Choose,img.png,1,x\r\n"
+            "a.wav,c.wav,70,Choose,img.png,2,y\r\n"
+        )
+        stimulus_model = StimulusModel(self.sessionpars)
+
+        matrix = stimulus_model._matrix_file
+        self.assertEqual(list(matrix.columns), list(MATRIX_SCHEMA))
+        self.assertEqual(matrix['pres_level'].dtype, np.float64)
+        self.assertEqual(matrix['category'].dtype, 'category')
+        self.assertEqual(stimulus_model.trials[1].category, '2')
+
+
+    def test_compiled_matrix(self):
+        """ The compiled matrix is written on first load and used
+            while the matrix file is unchanged.
+        """
+        first = StimulusModel(self.sessionpars)
+        compiled_path = os.path.join(self.tempdir.name, 'matrix.compiled.npz')
+        self.assertTrue(os.path.isfile(compiled_path))
+
+        with patch('models.stimulusmodel.pd.read_csv') as fake_read:
+            second = StimulusModel(self.sessionpars)
+            fake_read.assert_not_called()
+        pd.testing.assert_frame_equal(first._matrix_file, second._matrix_file)
+        self.assertEqual(first.trials, second.trials)
+
+        # Changed matrix file is parsed again
+        self._write_matrix(
+            "audio_A,audio_B,pres_level,instructions,image,category\r\n"
+            "stim_1.wav,stim_3.wav,60,Choose,img.png,1\r\n"
+        )
+        third = StimulusModel(self.sessionpars)
+        self.assertEqual(third.trials[0].pres_level, 60)
+
+
+    def test_index_refreshed(self):
+        """ The stimulus index is refreshed for the matrix audio 
+            files, including when the compiled matrix is used.
+        """
+        fake_index = MagicMock()
+        fake_index.get.return_value = None
+        expected = [
+            os.path.join('sample_audio_dir', 'stim_1.wav'),
+            os.path.join('sample_audio_dir', 'stim_2.wav')
+        ]
+
+        for _ in range(2):
+            fake_index.reset_mock()
+            StimulusModel(self.sessionpars, index=fake_index)
+            fake_index.refresh.assert_called_once()
+            self.assertEqual(
+                sorted(fake_index.refresh.call_args.args[0]), expected)
+
+
+    def test_level_compensation(self):
+        """ In 'rms' and 'loudness' modes, each file gets the gain 
+            that brings it to the reference level.
+        """
+        audio_dir = os.path.join(self.tempdir.name, 'audio')
+        os.mkdir(audio_dir)
+        fs = 48000
+        tone = np.sin(2 * np.pi * 997 * np.arange(fs) / fs)
+        sf.write(os.path.join(audio_dir, 'stim_1.wav'), 0.5 * tone, fs)
+        sf.write(os.path.join(audio_dir, 'stim_2.wav'), 0.05 * tone, fs)
+        self.sessionpars['audio_files_dir'].set(audio_dir)
+
+        # No gain in 'raw' mode
+        stimulus_model = StimulusModel(self.sessionpars)
+        path_1 = stimulus_model.trials[0].audio_A
+        path_2 = stimulus_model.trials[0].audio_B
+        self.assertEqual(stimulus_model.level_compensation(path_1), 0)
+
+        # RMS of a 0.5 sine is about -9 dB FS
+        self.sessionpars['level_mode'].set('rms')
+        stimulus_model = StimulusModel(self.sessionpars)
+        self.assertAlmostEqual(stimulus_model.level_compensation(path_1),
+            -20 - 20 * np.log10(0.5 / np.sqrt(2)), places=2)
+        self.assertAlmostEqual(
+            stimulus_model.level_compensation(path_2)
+            - stimulus_model.level_compensation(path_1), 20, places=2)
+
+        # Loudness of a full-scale 997 Hz sine is about -3 LKFS
+        self.sessionpars['level_mode'].set('loudness')
+        stimulus_model = StimulusModel(self.sessionpars)
+        self.assertAlmostEqual(stimulus_model.level_compensation(path_1),
+            -20 - (-3.01 + 20 * np.log10(0.5)), places=1)
+
+
+    def test_unreadable_audio_file(self):
+        """ Unreadable files do not stop the model from loading and
+            are reported with missing files.
+        """
+        audio_dir = os.path.join(self.tempdir.name, 'audio')
+        os.mkdir(audio_dir)
+        sf.write(os.path.join(audio_dir, 'stim_1.wav'), np.zeros(100), 
+            48000)
+        with open(os.path.join(audio_dir, 'stim_2.wav'), 'w') as fh:
+            fh.write("not audio")
+        self.sessionpars['audio_files_dir'].set(audio_dir)
+        self.sessionpars['level_mode'].set('rms')
+
+        stimulus_model = StimulusModel(self.sessionpars)
+        with self.assertRaises(audio_exceptions.MissingAudioFiles) as cm:
+            stimulus_model.check_audio_files()
+        self.assertEqual(cm.exception.files, [])
+        self.assertEqual(cm.exception.unreadable, 
+            [os.path.join(audio_dir, 'stim_2.wav')])
+
+
+    def test_check_clipping(self):
+        """ Trials are flagged from file peaks, presentation level
+            and SLM offset.
+        """
+        audio_dir = os.path.join(self.tempdir.name, 'audio')
+        os.mkdir(audio_dir)
+        sf.write(os.path.join(audio_dir, 'stim_1.wav'), 
+            np.full(100, 0.5), 48000)
+        sf.write(os.path.join(audio_dir, 'stim_2.wav'), 
+            np.full(100, 0.05), 48000)
+        self.sessionpars['audio_files_dir'].set(audio_dir)
+        stimulus_model = StimulusModel(self.sessionpars)
+
+        # 0.5 peak is about -6 dB FS: 75 - 70 leaves headroom
+        stimulus_model.check_clipping(70)
+
+        # 75 - 66 clips stim_1 in row 1 only
+        with self.assertRaises(audio_exceptions.ClippingTrials) as cm:
+            stimulus_model.check_clipping(66)
+        self.assertEqual(cm.exception.trials, [
+            (1, stimulus_model.trials[0].audio_A, 2.98)
+        ])
+
+
+    def test_matrix_columns_by_position(self):
+        """ Columns are read by position, whatever the header says.
+        """
+        self._write_matrix(
+            "Audio 1,Audio 2,Level (dB),Text,Picture,Group\r\n"
+            "a.wav,b.wav,75,Choose,img.png,1\r\n"
+        )
+        stimulus_model = StimulusModel(self.sessionpars)
+        trial = stimulus_model.trials[0]
+        self.assertEqual(os.path.basename(trial.audio_B), 'b.wav')
+        self.assertEqual(trial.pres_level, 75)
+        self.assertEqual(trial.category, '1')
+
+
+    def test_matrix_missing_column(self):
+        self._write_matrix(
+            "audio_A,audio_B,pres_level\r\n"
+            "a.wav,b.wav,75\r\n"
+        )
+        with self.assertRaises(audio_exceptions.InvalidMatrixFile):
+            StimulusModel(self.sessionpars)
+
+
+    def test_matrix_invalid_level(self):
+        self._write_matrix(
+            "audio_A,audio_B,pres_level,instructions,image,category\r\n"
+            "a.wav,b.wav,loud,Choose,img.png,1\r\n"
+        )
+        with self.assertRaises(audio_exceptions.InvalidMatrixFile):
+            StimulusModel(self.sessionpars)
+
+
+    def test_check_audio_files_reports_all_missing(self):
+        """ All missing audio files are reported in one exception.
+        """
+        self._write_matrix(
+            "audio_A,audio_B,pres_level,instructions,image,category\r\n"
+            "a.wav,b.wav,75,Choose,img.png,1\r\n"
+            "a.wav,c.wav,70,Choose,img.png,2\r\n"
+        )
+        stimulus_model = StimulusModel(self.sessionpars)
 
-        with patch('builtins.open', self.fake_data_file):
-            with patch('random.shuffle', side_effect=lambda x, r=rng: r.shuffle(x)):
-                stimulus_model = StimulusModel(sessionpars)
-                
-                self.assertEqual(stimulus_model.matrix.iloc[:,1].tolist(), [70,70,75,70,75,75])
+        with patch('models.stimulusmodel.os.path.isfile',
+                side_effect=lambda path: path.endswith('a.wav')):
+            with self.assertRaises(audio_exceptions.MissingAudioFiles) as cm:
+                stimulus_model.check_audio_files()
+        self.assertEqual(len(cm.exception.files), 2)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,108 @@
+""" Tests for wavfile """
+
+###########
+# Imports #
+###########
+# Import testing packages
+import unittest
+
+# Import data science packages
+import numpy as np
+
+# Import system packages
+import os
+import tempfile
+
+# Import audio packages
+import soundfile as sf
+
+# Import custom modules
+from models import wavfile
+from exceptions import audio_exceptions
+
+
+#########
+# Begin #
+#########
+class TestWavFile(unittest.TestCase):
+    """ Unit tests for wavfile functions. Results are compared
+        with soundfile.
+    """
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(0)
+        self.stereo = rng.uniform(-0.9, 0.9, size=(1000, 2))
+
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+
+    def _write(self, name, signal, subtype):
+        path = os.path.join(self.tempdir.name, name)
+        sf.write(path, signal, 44100, subtype=subtype)
+        return path
+
+
+    def test_pcm16_mapped(self):
+        path = self._write('pcm16.wav', self.stereo, 'PCM_16')
+        signal, fs = wavfile.read(path)
+
+        self.assertIsInstance(signal, np.memmap)
+        self.assertEqual(signal.dtype, np.int16)
+        self.assertEqual(signal.shape, (1000, 2))
+        self.assertEqual(fs, 44100)
+        self.assertFalse(signal.flags.writeable)
+
+        expected, _ = sf.read(path, dtype='float32')
+        np.testing.assert_array_equal(wavfile.to_float32(signal), expected)
+
+
+    def test_float_mono_mapped(self):
+        path = self._write('float.wav', self.stereo[:, 0], 'FLOAT')
+        signal, _ = wavfile.read(path)
+
+        self.assertEqual(signal.dtype, np.float32)
+        self.assertEqual(signal.shape, (1000,))
+        np.testing.assert_array_equal(signal, sf.read(path, dtype='float32')[0])
+
+
+    def test_extensible_format_mapped(self):
+        # soundfile writes WAVE_FORMAT_EXTENSIBLE for > 2 channels
+        signal = np.tile(self.stereo, 2)
+        path = self._write('quad.wav', signal, 'PCM_32')
+        mapped, _ = wavfile.read(path)
+
+        self.assertIsInstance(mapped, np.memmap)
+        self.assertEqual(mapped.shape, (1000, 4))
+        np.testing.assert_allclose(wavfile.to_float32(mapped), 
+            sf.read(path, dtype='float32')[0])
+
+
+    def test_sample_dtype(self):
+        path = self._write('pcm16.wav', self.stereo, 'PCM_16')
+        self.assertEqual(wavfile.sample_dtype(path), np.int16)
+
+
+    def test_pcm24_decoded(self):
+        path = self._write('pcm24.wav', self.stereo, 'PCM_24')
+        with self.assertRaises(audio_exceptions.UnsupportedWavFormat):
+            wavfile.read_mapped(path)
+
+        signal, _ = wavfile.read(path)
+        self.assertNotIsInstance(signal, np.memmap)
+        self.assertEqual(signal.dtype, np.float64)
+        self.assertEqual(wavfile.sample_dtype(path), np.float64)
+
+
+    def test_to_float32_blocks(self):
+        signal = np.array([-32768, 0, 16384, 32767] * 3, dtype=np.int16)
+        result = wavfile.to_float32(signal, blocksize=5)
+        self.assertEqual(result.dtype, np.float32)
+        np.testing.assert_array_equal(result[:4], 
+            [-1, 0, 0.5, 32767 / 32768])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,8 +8,8 @@
 import tkinter as tk
 from tkinter import ttk
 
-# Import audio packages
-import sounddevice as sd
+# Import custom modules
+from models import devicecache
 
 
 #########
@@ -91,15 +91,48 @@ class AudioDialog(tk.Toplevel):
         ttk.Entry(lfrm_routing, textvariable=self.audio_var, state='disabled'
         ).grid(row=10, column=10, pady=(0,10), sticky='we', padx=(0,10))
 
+        # A/B switching mode
+        # Label
+        ttk.Label(lfrm_routing, text="A/B Switching:").grid(column=5, 
+            row=15, padx=5, pady=(0,10), sticky='e'
+        )
+        # Combobox
+        self.switch_var = tk.StringVar(
+            value=self.sessionpars['switch_mode'].get())
+        ttk.Combobox(lfrm_routing, textvariable=self.switch_var, 
+            values=['restart', 'hard', 'crossfade'], state='readonly', 
+            width=12).grid(row=15, column=10, pady=(0,10), sticky='w')
+
+        # Streaming threshold
+        # Label
+        ttk.Label(lfrm_routing, text="Stream Stimuli Over (s):").grid(
+            column=5, row=20, padx=5, pady=(0,10), sticky='e'
+        )
+        # Entry
+        ttk.Entry(lfrm_routing, textvariable=self.sessionpars['stream_min_s'],
+            width=15).grid(row=20, column=10, pady=(0,10), sticky='w')
+
+        # Output sampling rate
+        # Label
+        ttk.Label(lfrm_routing, text="Sampling Rate (Hz):").grid(
+            column=5, row=25, padx=5, pady=(0,10), sticky='e'
+        )
+        # Entry
+        ttk.Entry(lfrm_routing, 
+            textvariable=self.sessionpars['audio_samplerate'],
+            width=15).grid(row=25, column=10, pady=(0,10), sticky='w')
+
         # Create treeview
         # Treeview instructions label
         ttk.Label(self.frm_tree, text="Click on an audio device below to " +
             "select it.", style='Bold.TLabel').grid(row=5, column=5)
         self.tree = self._create_tree_widget()
 
-        # Submit button
+        # Refresh and submit buttons
+        ttk.Button(frm_submit, text="Refresh Devices", 
+            command=self._on_refresh).grid(column=5, row=5, padx=(0,10))
         ttk.Button(frm_submit, text="Submit", command=self._on_submit).grid(
-            column=5, columnspan=15, row=5)
+            column=10, row=5)
         
 
     def _get_audio_device_name(self):
@@ -147,21 +180,27 @@ class AudioDialog(tk.Toplevel):
 
     def _query_audio_devices(self):
         """ Create list of tuples with specified device information.
+            Uses the shared device cache; devices are only 
+            enumerated again on refresh.
         """
-        # Get list of audio devices
-        deviceList = sd.query_devices()
-        print("\naudioview: Full audio device list:")
-        print(deviceList)
-
-        # Create list of tuples with device info
-        devices = []
-        for ii in range(0,len(deviceList)):
-            if deviceList[ii]['max_output_channels'] > 0:
-                devices.append((ii, deviceList[ii]['name'], 
-                                deviceList[ii]['max_output_channels']))
+        devices = devicecache.output_devices()
+        print("\naudioview: Audio output devices:")
+        for device in devices:
+            print(device)
         return devices
 
 
+    def _on_refresh(self):
+        """ Enumerate audio devices again and repopulate tree.
+        """
+        devicecache.refresh()
+        self.devices = self._query_audio_devices()
+        self.tree.delete(*self.tree.get_children())
+        for self.device in self.devices:
+            self.tree.insert('', tk.END, values=self.device)
+        self.audio_var.set(self._get_audio_device_name())
+
+
     #################
     # General Funcs #
     #################
@@ -197,5 +236,6 @@ class AudioDialog(tk.Toplevel):
         """
         print("\naudioview: Sending save audio device event...")
         self.sessionpars['channel_routing'].set(self.routing_var.get())
+        self.sessionpars['switch_mode'].set(self.switch_var.get())
         self.parent.event_generate('<<AudioDialogSubmit>>')
         self.destroy()
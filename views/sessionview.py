@@ -88,6 +88,40 @@ class SessionDialog(tk.Toplevel):
             textvariable=self.sessionpars['repetitions']
             ).grid(row=10, column=10, sticky='w')
 
+        # Random seed (0 = new seed each session)
+        ttk.Label(frm_options, text="Random Seed:"
+            ).grid(row=15, column=5, sticky='e', **widget_options)
+        ttk.Entry(frm_options, width=20, 
+            textvariable=self.sessionpars['random_seed']
+            ).grid(row=15, column=10, sticky='w')
+
+        # Randomization constraints
+        ttk.Checkbutton(frm_options, text="No back-to-back repeats",
+            takefocus=0, variable=self.sessionpars['no_repeats']
+            ).grid(row=20, column=5, columnspan=20, sticky='w', 
+            **widget_options)
+        ttk.Checkbutton(frm_options, text="Balance A/B positions",
+            takefocus=0, variable=self.sessionpars['swap_ab']
+            ).grid(row=25, column=5, columnspan=20, sticky='w', 
+            **widget_options)
+        ttk.Checkbutton(frm_options, text="Block by category",
+            takefocus=0, variable=self.sessionpars['block_by_category']
+            ).grid(row=30, column=5, columnspan=20, sticky='w', 
+            **widget_options)
+
+        # Level matching between files
+        ttk.Label(frm_options, text="Level Matching:"
+            ).grid(row=35, column=5, sticky='e', **widget_options)
+        ttk.Combobox(frm_options, width=17, state='readonly',
+            values=['raw', 'rms', 'loudness'],
+            textvariable=self.sessionpars['level_mode']
+            ).grid(row=35, column=10, sticky='w')
+        ttk.Label(frm_options, text="Match To (dB FS/LKFS):"
+            ).grid(row=40, column=5, sticky='e', **widget_options)
+        ttk.Entry(frm_options, width=20, 
+            textvariable=self.sessionpars['match_ref_dB']
+            ).grid(row=40, column=10, sticky='w')
+
 
         ###################
         # Audio Directory #